@@ -0,0 +1,121 @@
+import json
+import logging
+
+import paho.mqtt.client as mqtt
+
+from variables import MQTT_CODEC, MQTT_TOPIC_CODECS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JsonCodec:
+    #orjson when it is installed (bytes, no spaces), the json module otherwise
+    name = "json"
+
+    def encode(self, message):
+        if orjson is not None:
+            return orjson.dumps(message)
+        return json.dumps(message)
+
+    def decode(self, payload):
+        if orjson is not None:
+            return orjson.loads(payload)
+        return json.loads(payload)
+
+
+class CborCodec:
+    name = "cbor"
+
+    def encode(self, message):
+        return cbor2.dumps(message)
+
+    def decode(self, payload):
+        return cbor2.loads(payload)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, message):
+        return msgpack.packb(message)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload)
+
+
+CODECS = {"json": JsonCodec, "cbor": CborCodec, "msgpack": MsgpackCodec}
+MODULES = {"cbor": lambda: cbor2, "msgpack": lambda: msgpack}
+
+
+def get_codec(name):
+    name = name.strip().lower()
+    if name not in CODECS:
+        raise ValueError(f"Unknown MQTT codec {name}. Use one of: {', '.join(CODECS)}")
+    if name in MODULES and MODULES[name]() is None:
+        raise ValueError(f"MQTT codec {name} needs the {'cbor2' if name == 'cbor' else 'msgpack'} package")
+    return CODECS[name]()
+
+
+#"topic=codec,other/+/topic=codec" -> [(topic filter, codec)]
+def parse_topic_codecs(value):
+    topic_codecs = []
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        topic, _, name = entry.rpartition("=")
+        if not topic.strip():
+            raise ValueError(f"Invalid MQTT topic codec {entry}. Use topic=codec")
+        topic_codecs.append((topic.strip(), get_codec(name)))
+    return topic_codecs
+
+
+class TopicCodecs:
+    """
+    Chooses how the MQTT payloads of each topic are encoded. Topics are matched
+    against the filters (MQTT wildcards allowed) in order, and the ones that
+    don't match any use the default codec. The same codec is used for the
+    messages sent and received on a topic, so both sides of a topic have to
+    agree on it.
+    """
+
+    def __init__(self, default, topic_codecs=()):
+        self.default = default
+        self.topic_codecs = list(topic_codecs)
+        self.cache = {}
+
+    def forTopic(self, topic):
+        codec = self.cache.get(topic)
+        if codec is None:
+            codec = next((codec for topic_filter, codec in self.topic_codecs if mqtt.topic_matches_sub(topic_filter, topic)), self.default)
+            self.cache[topic] = codec
+        return codec
+
+    def encode(self, topic, message):
+        return self.forTopic(topic).encode(message)
+
+    def decode(self, topic, payload):
+        return self.forTopic(topic).decode(payload)
+
+
+def load_topic_codecs():
+    try:
+        return TopicCodecs(get_codec(MQTT_CODEC), parse_topic_codecs(MQTT_TOPIC_CODECS))
+    except ValueError as err:
+        logging.error("%s. Using json for every topic", err)
+        return TopicCodecs(JsonCodec())
+
+
+topic_codecs = load_topic_codecs()
@@ -1,20 +1,17 @@
-import json
 import logging
 import os
 import sys
 import time
 import paho.mqtt.client as mqtt
 import threading
-import json
 from dotenv import load_dotenv
 load_dotenv() 
 
 from database.dao.equipmentVariables import EquipmentVariablesDAO
-from variables import FIRST_RECONNECT_DELAY, RECONNECT_RATE, MAX_RECONNECT_DELAY
+from variables import FIRST_RECONNECT_DELAY, MAX_RECONNECT_DELAY, MESSAGE_WORKERS, MESSAGE_QUEUE_SIZE, MESSAGE_REPORT_INTERVAL, TELEMETRY_FLUSH_WAIT_TIMEOUT
 from database.dao.alarm import AlarmDAO
 from database.dao.counterRecord import CounterRecordDAO
-import database.connectDB
-from database.config import load_config
+from database.connectionPool import db_pool
 from service.message import MessageService
 from service.configuration import ConfigurationService
 from database.dao.activeTime import ActiveTimeDAO
@@ -23,6 +20,12 @@ from database.dao.configuration import ConfigurationDAO
 from service.productionOrder import ProductionOrderService
 from service.productionCount import productionCount
 from service.received import messageReceived
+from service.PLC.connectionPool import plc_pool
+from service.telemetryWriter import telemetry_writer
+from service.partitionMaintenance import partition_maintenance
+from api.codec import topic_codecs
+from service.messageDispatcher import MessageDispatcher
+from service.outbox import outbox
 
 topicReceive = os.getenv("topicReceive")
 topicSend = os.getenv("topicSend")
@@ -31,109 +34,101 @@ def on_connect(client, userdata, flags, rc):
     if rc != 0:
         print("Error when connecting: "+str(rc))
         sys.exit(0)
+    outbox.setConnected(True)
         
         
 def on_disconnect(client, userdata, rc): #it is used when internet connection is bad and it auto disconnects
+    #paho's network loop reconnects by itself (see reconnect_delay_set in subscribe), meanwhile the messages go to the outbox
     logging.info("Disconnected with result code: %s", rc)
-    reconnect_count, reconnect_delay = 0, int(FIRST_RECONNECT_DELAY)
-
-    while True:
-        logging.info("Reconnecting in %d seconds...", reconnect_delay)
-        time.sleep(int(reconnect_delay))
-
-        try:
-            client.reconnect()
-            logging.info("Reconnected successfully!")
-            return
-        except Exception as err:
-            logging.error("%s. Reconnect failed. Retrying...", err)
-
-        reconnect_delay *= int(RECONNECT_RATE)
-        reconnect_delay = min(reconnect_delay, int(MAX_RECONNECT_DELAY))
+    outbox.setConnected(False)
 
 def on_message(client, userdata, msg):
-    message = json.loads(msg.payload)
-
+    #runs on the network thread: only decode and queue, the workers do the rest
+    try:
+        message = topic_codecs.decode(msg.topic, msg.payload)
+    except Exception as err:
+        logging.error("%s. Message on %s could not be decoded", err, msg.topic)
+        return
+    message_dispatcher.submit(message.get("equipmentCode"), client, message)
+
+def sendResponse(client, message, jsonType):
+    #the values just read from the PLC may still be in the telemetry buffer. Wait for them before taking
+    #a connection: the writer needs one from the same pool to flush them
+    if not telemetry_writer.wait_for_flush(float(TELEMETRY_FLUSH_WAIT_TIMEOUT)):
+        logging.warning("Telemetry wasn't flushed in %s seconds. %s may have old values", TELEMETRY_FLUSH_WAIT_TIMEOUT, jsonType)
+
+    with db_pool.connection() as conn:
+        message_service = MessageService(ConfigurationDAO(conn), ActiveTimeDAO(conn), CounterRecordDAO(conn), AlarmDAO(conn))
+        message_service.sendResponseMessage(client, topicSend, message, jsonType)
+
+def handleMessage(client, message):
     match message["jsonType"]:
         case "Configuration":
             try:
-                config = load_config()
-                conn = database.connectDB.connect(config)
-                active_time_dao = ActiveTimeDAO(conn)
-                configuration_dao = ConfigurationDAO(conn)
-                counter_record_dao = CounterRecordDAO(conn)
-                alarm_dao = AlarmDAO(conn)
-                configuration_service = ConfigurationService(configuration_dao)
-                configuration_service.createConfiguration(message)
+                with db_pool.connection() as conn:
+                    configuration_dao = ConfigurationDAO(conn)
+                    configuration_service = ConfigurationService(configuration_dao)
+                    configuration_service.createConfiguration(message)
 
             except Exception as e:
                 print(f"An error occurred: {e}")
 
             finally:
-                message_service = MessageService(configuration_dao, active_time_dao, counter_record_dao, alarm_dao)
-                message_service.sendResponseMessage(client, topicSend, message, "ConfigurationResponse")   
-                conn.close()
-                print("Connection to the PostgreSQL server was closed")             
+                sendResponse(client, message, "ConfigurationResponse")
 
         case "ProductionOrder":
             try:
-                config = load_config()
-                conn = database.connectDB.connect(config)
-                configuration_dao = ConfigurationDAO(conn)
-                production_order_dao = ProductionOrderDAO(conn)
-                active_time_dao = ActiveTimeDAO(conn)
-                counter_record_dao = CounterRecordDAO(conn)
-                alarm_dao = AlarmDAO(conn)
-                equipment_variables_dao = EquipmentVariablesDAO(conn)
-                production_order_service = ProductionOrderService(configuration_dao, production_order_dao, active_time_dao, equipment_variables_dao)
-                production_order_service.productionOrderInit(message)
-                            
+                with db_pool.connection() as conn:
+                    configuration_dao = ConfigurationDAO(conn)
+                    production_order_dao = ProductionOrderDAO(conn)
+                    active_time_dao = ActiveTimeDAO(conn)
+                    equipment_variables_dao = EquipmentVariablesDAO(conn)
+                    production_order_service = ProductionOrderService(configuration_dao, production_order_dao, active_time_dao, equipment_variables_dao)
+                    production_order_service.productionOrderInit(message)
+
             except Exception as e:
                 print(f"An error occurred: {e}")
 
             finally:
-                message_service = MessageService(configuration_dao, active_time_dao, counter_record_dao, alarm_dao)
-                message_service.sendResponseMessage(client, topicSend, message, "ProductionOrderResponse")
-                conn.close()
-                print("Connection to the PostgreSQL server was closed")
+                sendResponse(client, message, "ProductionOrderResponse")
 
         case "ProductionOrderConclusion":
             try:
-                config = load_config()
-                conn = database.connectDB.connect(config)
-                configuration_dao = ConfigurationDAO(conn)
-                production_order_dao = ProductionOrderDAO(conn)
-                active_time_dao = ActiveTimeDAO(conn)
-                counter_record_dao = CounterRecordDAO(conn)
-                alarm_dao = AlarmDAO(conn)
-                equipment_variables_dao = EquipmentVariablesDAO(conn)
-                production_order_service = ProductionOrderService(configuration_dao, production_order_dao, active_time_dao, equipment_variables_dao)
-                production_order_service.productionOrderConclusion(message)
-                                    
+                with db_pool.connection() as conn:
+                    configuration_dao = ConfigurationDAO(conn)
+                    production_order_dao = ProductionOrderDAO(conn)
+                    active_time_dao = ActiveTimeDAO(conn)
+                    equipment_variables_dao = EquipmentVariablesDAO(conn)
+                    production_order_service = ProductionOrderService(configuration_dao, production_order_dao, active_time_dao, equipment_variables_dao)
+                    production_order_service.productionOrderConclusion(message)
+
             except Exception as e:
                 print(f"An error occurred: {e}")
 
             finally:
-                message_service = MessageService(configuration_dao, active_time_dao, counter_record_dao, alarm_dao)
-                message_service.sendResponseMessage(client, topicSend, message, "ProductionOrderConclusionResponse")
-                
-                conn.close()
-                print("Connection to the PostgreSQL server was closed")
-        
-        
+                sendResponse(client, message, "ProductionOrderConclusionResponse")
+
         case "Received":
             messageReceived(client, topicSend, message)
         
         case _:
             print("This code is not prepared to resolve this request.")
 
+message_dispatcher = MessageDispatcher(handleMessage, int(MESSAGE_WORKERS), int(MESSAGE_QUEUE_SIZE), float(MESSAGE_REPORT_INTERVAL))
+
 
 def subscribe(client):
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
+    client.reconnect_delay_set(min_delay=int(FIRST_RECONNECT_DELAY), max_delay=int(MAX_RECONNECT_DELAY))
     client.subscribe(topicReceive, qos=1)   
 
+    outbox.start(client)
+
+    telemetry_writer.start()
+    partition_maintenance.start()
+    message_dispatcher.start()
     periodically_messages_thread = threading.Thread(target=productionCount, args=(client, topicSend ))
     periodically_messages_thread.daemon = True
     periodically_messages_thread.start()  
@@ -144,6 +139,12 @@ def subscribe(client):
             time.sleep(1) 
     except KeyboardInterrupt:
         print("Ctrl+C pressed... Shutting down.")
+        message_dispatcher.stop()
+        plc_pool.close_all()
+        partition_maintenance.stop()
+        telemetry_writer.stop()
+        outbox.stop()
+        db_pool.close_all()
     return 0
 
 
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+from database.config import load_config
+from variables import DB_POOL_MIN, DB_POOL_MAX, DB_POOL_HEALTH_CHECK_INTERVAL, DB_POOL_REPORT_INTERVAL
+
+
+class DatabaseConnectionPool:
+    """
+    Process-wide pool of PostgreSQL connections shared by the MQTT handlers and
+    the polling loop.
+
+    Callers check a connection out with connection() and hand it to the DAOs.
+    When every connection is in use the caller waits for one to come back
+    instead of failing. A connection that was idle for more than
+    health_check_interval seconds is checked with SELECT 1 before being handed
+    out, and replaced if it is broken.
+
+    Every report_interval seconds the pool logs the checkouts, how many of them
+    had to wait and for how long, and the connections in use.
+    """
+
+    def __init__(self, minconn, maxconn, health_check_interval=30, report_interval=60, config_loader=load_config):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_interval = health_check_interval
+        self.report_interval = report_interval
+        self.config_loader = config_loader
+        self.pool = None
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(maxconn)
+        self.last_used = {}
+        self.stats = {"checkouts": 0, "waits": 0, "wait_time": 0.0, "discarded": 0, "in_use": 0}
+        self.last_report = (time.monotonic(), dict(self.stats))
+
+    def _get_pool(self):
+        #created on first use, so importing this module doesn't connect to the database
+        with self.lock:
+            if self.pool is None:
+                self.pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, **self.config_loader())
+                print('Connected to the PostgreSQL server.')
+            return self.pool
+
+    def is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        connection_pool = self._get_pool()
+        conn = connection_pool.getconn()
+        while not self.is_healthy(conn):
+            logging.warning("Discarding broken PostgreSQL connection")
+            self.last_used.pop(id(conn), None)
+            connection_pool.putconn(conn, close=True)
+            with self.lock:
+                self.stats["discarded"] += 1
+            conn = connection_pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        started = time.monotonic()
+        if not self.available.acquire(blocking=False):
+            logging.warning("All %d PostgreSQL connections are in use. Waiting...", self.maxconn)
+            self.available.acquire()
+            with self.lock:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += time.monotonic() - started
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self.available.release()
+            raise
+
+        with self.lock:
+            self.stats["checkouts"] += 1
+            self.stats["in_use"] += 1
+
+        try:
+            yield conn
+        finally:
+            #putconn rolls back whatever transaction the caller left open
+            self.last_used[id(conn)] = time.monotonic()
+            self.pool.putconn(conn, close=conn.closed != 0)
+            with self.lock:
+                self.stats["in_use"] -= 1
+            self.available.release()
+            if self.report_interval and time.monotonic() - self.last_report[0] >= self.report_interval:
+                self.report()
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, max=self.maxconn)
+
+    def report(self):
+        now = time.monotonic()
+        with self.lock:
+            since, stats_before = self.last_report
+            if now - since < self.report_interval:
+                #another thread just reported
+                return None
+            stats = dict(self.stats)
+            self.last_report = (now, stats)
+        checkouts = stats["checkouts"] - stats_before["checkouts"]
+        waits = stats["waits"] - stats_before["waits"]
+        wait_time = (stats["wait_time"] - stats_before["wait_time"]) / waits if waits else 0
+        logging.info("PostgreSQL pool: %d checkouts, %d waited (%.3fs average), %d/%d in use, %d broken connections discarded",
+                     checkouts, waits, wait_time, stats["in_use"], self.maxconn, stats["discarded"] - stats_before["discarded"])
+        return checkouts, waits, wait_time
+
+    def close_all(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+                print("Connection to the PostgreSQL server was closed")
+
+
+db_pool = DatabaseConnectionPool(int(DB_POOL_MIN), int(DB_POOL_MAX), float(DB_POOL_HEALTH_CHECK_INTERVAL), float(DB_POOL_REPORT_INTERVAL))
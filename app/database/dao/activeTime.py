@@ -4,6 +4,15 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
+from database.dao.telemetry import TelemetryDAO
+from database.preparedStatements import prepared_statements
+
+GET_LAST_ACTIVE_TIME_BY_EQUIPMENT_ID = prepared_statements.register("get_last_active_time_by_equipment_id", """
+SELECT *
+FROM active_time_latest
+WHERE equipment_id = %s
+""")
+
 
 class ActiveTimeDAO:
     def __init__(self, connection):
@@ -27,50 +36,49 @@ class ActiveTimeDAO:
     def getLastActiveTimeByEquipmentId(self, equipment_id):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                get_last_active_time_by_equipmentId_query = sql.SQL("""
-                SELECT *
-                FROM active_time
-                WHERE equipment_id = %s
-                ORDER BY registered_at DESC
-                """)
-                cursor.execute(get_last_active_time_by_equipmentId_query, (equipment_id,))
+                prepared_statements.execute(cursor, GET_LAST_ACTIVE_TIME_BY_EQUIPMENT_ID, (equipment_id,))
                 at_found = cursor.fetchone()
                 return at_found
             
         except Exception as err:
-            logging.error("%s. getActiveTimeByEquipmentId failed.", err)
+            logging.error("%s. getLastActiveTimeByEquipmentId failed.", err)
 
     def insertActiveTime(self, equipment_id, active_time):
-        try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                ct = datetime.datetime.now()
-
-                insert_active_time_query = """
-                INSERT INTO active_time (equipment_id, active_time, registered_at)
-                VALUES (%s,%s,%s)
-                """
-                cursor.execute(insert_active_time_query, (equipment_id, active_time, ct))
-                self.connection.commit()
-                print("Active time inserted for equipment: " + str(equipment_id))
-
-        except Exception as err:
-            logging.error("%s. insertActiveTime failed", err)
+        #same path as the batched writes, so the latest value and the running totals stay in sync
+        telemetry_dao = TelemetryDAO(self.connection)
+        production_order_id = telemetry_dao.getOpenProductionOrderId("active_time", equipment_id)
+        if telemetry_dao.insertTelemetryBatch([], [(equipment_id, active_time, datetime.datetime.now(), production_order_id)], []) is True:
+            print("Active time inserted for equipment: " + str(equipment_id))
 
     #get active_time by equipment_id
     def getActiveTimeTotalValueByEquipmentId(self, data):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 check_active_time_total_value_query = sql.SQL("""
-                SELECT at.equipment_id, SUM(at.active_time) AS totalActiveValue
-                FROM active_time at
-                JOIN counting_equipment ce ON at.equipment_id = ce.id
-                WHERE ce.id = %s
-                GROUP BY at.equipment_id
+                SELECT att.equipment_id, att.total AS totalActiveValue
+                FROM active_time_total att
+                WHERE att.equipment_id = %s AND att.production_order_id = %s
                 """)
                 
-                cursor.execute(check_active_time_total_value_query, (data, ))
+                cursor.execute(check_active_time_total_value_query, (data, 0))
                 equipment_found = cursor.fetchone()
                 return equipment_found
             
         except Exception as err:
-            logging.error("%s. getCounterRecordTotalValueByEquipmentOutputId failed", err)
\ No newline at end of file
+            logging.error("%s. getCounterRecordTotalValueByEquipmentOutputId failed", err)
+
+    #get the active time of an equipment during a production order
+    def getActiveTimeTotalValueByProductionOrderId(self, production_order_id):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                get_production_order_active_time_query = sql.SQL("""
+                SELECT equipment_id, total AS totalActiveValue, resets, wraps
+                FROM active_time_total
+                WHERE production_order_id = %s
+                """)
+                cursor.execute(get_production_order_active_time_query, (production_order_id,))
+                at_found = cursor.fetchone()
+                return at_found
+            
+        except Exception as err:
+            logging.error("%s. getActiveTimeTotalValueByProductionOrderId failed", err)
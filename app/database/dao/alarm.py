@@ -4,6 +4,10 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
+from database.preparedStatements import prepared_statements
+
+GET_ALARMS_BY_EQUIPMENT_ID = prepared_statements.register("get_alarms_by_equipment_id", """SELECT * FROM alarm WHERE equipment_id = %s ORDER BY id DESC limit 1""")
+
 class AlarmDAO:
     def __init__(self, connection):
         self.connection = connection
@@ -11,8 +15,7 @@ class AlarmDAO:
     def getAlarmsByEquipmentId(self, equipment_id):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                get_alarms_by_equipmentId_query = sql.SQL("""SELECT * FROM alarm WHERE equipment_id = %s ORDER BY id DESC limit 1""")
-                cursor.execute(get_alarms_by_equipmentId_query, (equipment_id,))
+                prepared_statements.execute(cursor, GET_ALARMS_BY_EQUIPMENT_ID, (equipment_id,))
                 alarms_found = cursor.fetchone()
                 return alarms_found
             
@@ -1,7 +1,22 @@
 import logging
 import psycopg2
 from psycopg2 import sql
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+
+from database.preparedStatements import prepared_statements
+
+GET_COUNTING_EQUIPMENT_BY_CODE = prepared_statements.register("get_counting_equipment_by_code", """
+SELECT *
+FROM counting_equipment
+WHERE code = %s
+LIMIT 1
+""")
+
+UPDATE_COUNTING_EQUIPMENT_STATUS = prepared_statements.register("update_counting_equipment_status", """
+UPDATE counting_equipment
+SET equipment_status = %s
+WHERE id = %s AND equipment_status IS DISTINCT FROM %s
+""")
 
 class ConfigurationDAO:
     def __init__(self, connection):
@@ -10,13 +25,7 @@ class ConfigurationDAO:
     def getCountingEquipmentByCode(self, data):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                check_if_counting_equipment_exists_query = sql.SQL("""
-                SELECT *
-                FROM counting_equipment
-                WHERE code = %s
-                LIMIT 1
-                """)
-                cursor.execute(check_if_counting_equipment_exists_query, (data["equipmentCode"],))
+                prepared_statements.execute(cursor, GET_COUNTING_EQUIPMENT_BY_CODE, (data["equipmentCode"],))
                 equipment_found = cursor.fetchone()
                 return equipment_found
             
@@ -93,15 +102,12 @@ class ConfigurationDAO:
     def updateCountingEquipmentStatus(self, equipment_id, equipment_status):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                update_counting_equipment_status_query = sql.SQL("""
-                UPDATE counting_equipment
-                SET equipment_status = %s
-                WHERE id = %s
-                """)
-                cursor.execute(update_counting_equipment_status_query, (equipment_status, equipment_id))
+                #the status is written on every poll, but only changes create a new row version
+                prepared_statements.execute(cursor, UPDATE_COUNTING_EQUIPMENT_STATUS, (equipment_status, equipment_id, equipment_status))
     
                 self.connection.commit()
-                print("Updated counting_equipment status")
+                if cursor.rowcount:
+                    print("Updated counting_equipment status")
         
         except Exception as err:
             logging.error("%s. updateCountingEquipmentStatus failed", err)
@@ -169,18 +175,45 @@ class ConfigurationDAO:
     def insertEquipmentOutput(self, inserted_ce_id, data):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                new_equipment_output_query = """
-                    INSERT INTO equipment_output (equipment_id, code)
-                    VALUES (%s, %s);
-                    """
-                for output in data["outputCodes"]:
-                    cursor.execute(new_equipment_output_query, (inserted_ce_id, output))
+                output_codes = list(dict.fromkeys(data["outputCodes"]))
+                if output_codes:
+                    new_equipment_output_query = """
+                        INSERT INTO equipment_output (equipment_id, code)
+                        VALUES %s
+                        """
+                    execute_values(cursor, new_equipment_output_query, [(inserted_ce_id, output) for output in output_codes])
                     self.connection.commit()
-                    print("Insert equipment_output: " + output)
+                    print("Insert equipment_output: " + ", ".join(output_codes))
 
         except Exception as err:
+            self.connection.rollback()
             logging.error("%s. insertEquipmentOutput failed", err)
 
+    #disable the removed outputs and insert the added ones in a single transaction
+    def updateEquipmentOutputs(self, equipment_id, removed_codes, added_codes):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                if removed_codes:
+                    disable_outputs_query = sql.SQL("""
+                    UPDATE equipment_output
+                    SET disable = 1
+                    WHERE equipment_id = %s AND disable = 0 AND code = ANY(%s)
+                    """)
+                    cursor.execute(disable_outputs_query, (equipment_id, list(removed_codes)))
+
+                if added_codes:
+                    execute_values(cursor, """
+                    INSERT INTO equipment_output (equipment_id, code)
+                    VALUES %s
+                    """, [(equipment_id, code) for code in added_codes])
+
+                self.connection.commit()
+                print(f"Updated equipment_output: {len(removed_codes)} disabled, {len(added_codes)} inserted")
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. updateEquipmentOutputs failed", err)
+
     def deleteEquipmentOutput(self, updated_ce_id):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
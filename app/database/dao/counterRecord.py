@@ -4,40 +4,48 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
+from database.dao.telemetry import TelemetryDAO
+from database.preparedStatements import prepared_statements
+
+GET_LAST_COUNTER_RECORD_BY_EQUIPMENT_OUTPUT_ID = prepared_statements.register("get_last_counter_record_by_equipment_output_id", """
+SELECT *
+FROM counter_record_latest
+WHERE equipment_output_id = %s
+""")
+
+GET_LAST_COUNTER_RECORDS_BY_EQUIPMENT_ID = prepared_statements.register("get_last_counter_records_by_equipment_id", """
+SELECT eo.id AS equipment_output_id, eo.code, COALESCE(crl.real_value, 0) AS real_value
+FROM equipment_output eo
+LEFT JOIN counter_record_latest crl ON crl.equipment_output_id = eo.id
+WHERE eo.equipment_id = %s AND eo.disable = %s
+ORDER BY eo.id
+""")
+
+
 class CounterRecordDAO:
     def __init__(self, connection):
         self.connection = connection
 
     #inserir counter record
     def insertCounterRecord(self, id, value):
-        try:
-            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                ct = datetime.datetime.now()
-
-                new_counter_record_query = """
-                INSERT INTO counter_record (equipment_output_id, real_value, registered_at)
-                VALUES (%s, %s, %s)
-                """
-                cursor.execute(new_counter_record_query, (id, value, ct))
-                self.connection.commit()
-                print("Insert counting_equipment")
-
-        except Exception as err:
-            logging.error("%s. insertCounterRecord failed", err)
+        #same path as the batched writes, so the latest value and the running totals stay in sync
+        telemetry_dao = TelemetryDAO(self.connection)
+        production_order_id = telemetry_dao.getOpenProductionOrderId("counter_record", id)
+        if telemetry_dao.insertTelemetryBatch([(id, value, datetime.datetime.now(), production_order_id)], [], []) is True:
+            print("Insert counting_equipment")
         
     #get counter record by equipment_output_id
     def getCounterRecordTotalValueByEquipmentOutputId(self, data):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 check_counter_record_total_value_query = sql.SQL("""
-                SELECT cr.equipment_output_id, SUM(cr.real_value) AS totalValue
-                FROM counter_record cr
-                JOIN equipment_output eo ON cr.equipment_output_id = eo.id
-                WHERE cr.equipment_output_id = %s AND eo.disable = %s
-                GROUP BY cr.equipment_output_id
+                SELECT crt.equipment_output_id, crt.total AS totalValue
+                FROM counter_record_total crt
+                JOIN equipment_output eo ON crt.equipment_output_id = eo.id
+                WHERE crt.equipment_output_id = %s AND crt.production_order_id = %s AND eo.disable = %s
                 """)
                 
-                cursor.execute(check_counter_record_total_value_query, (data, 0))
+                cursor.execute(check_counter_record_total_value_query, (data, 0, 0))
                 equipment_found = cursor.fetchone()
                 return equipment_found
             
@@ -48,31 +56,53 @@ class CounterRecordDAO:
     def getLastCounterRecordByEquipmentOutputId(self, equipment_output_id):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                check_counter_record_total_value_query = sql.SQL("""
-                SELECT *
-                FROM counter_record 
-                WHERE equipment_output_id = %s
-                ORDER BY registered_at DESC
-                """)
-                
-                cursor.execute(check_counter_record_total_value_query, (equipment_output_id,))
+                prepared_statements.execute(cursor, GET_LAST_COUNTER_RECORD_BY_EQUIPMENT_OUTPUT_ID, (equipment_output_id,))
                 equipment_found = cursor.fetchone()
                 return equipment_found
             
         except Exception as err:
-            logging.error("%s. getCounterRecordTotalValueByEquipmentOutputId failed", err)
+            logging.error("%s. getLastCounterRecordByEquipmentOutputId failed", err)
+
+    #get the last counter record of every enabled output of an equipment (0 when the output has none yet)
+    def getLastCounterRecordsByEquipmentId(self, equipment_id):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                prepared_statements.execute(cursor, GET_LAST_COUNTER_RECORDS_BY_EQUIPMENT_ID, (equipment_id, 0))
+                counters_found = cursor.fetchall()
+                return counters_found
+            
+        except Exception as err:
+            logging.error("%s. getLastCounterRecordsByEquipmentId failed", err)
 
     def getCounterRecordTotalValueByEquipmentOutput(self):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 check_counter_record_total_value_query = sql.SQL("""
-                SELECT equipment_output_id, SUM(real_value) as totalValue
-                FROM counter_record
-                GROUP BY equipment_output_id
+                SELECT equipment_output_id, total as totalValue
+                FROM counter_record_total
+                WHERE production_order_id = 0
                 """)
                 cursor.execute(check_counter_record_total_value_query)
                 equipment_found = cursor.fetchall()
                 return equipment_found
             
         except Exception as err:
-            logging.error("%s. getCounterRecordTotalValueByEquipmentOutput failed", err)
\ No newline at end of file
+            logging.error("%s. getCounterRecordTotalValueByEquipmentOutput failed", err)
+
+    #get the count of every output during a production order
+    def getCounterRecordTotalValueByProductionOrderId(self, production_order_id):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                get_production_order_totals_query = sql.SQL("""
+                SELECT crt.equipment_output_id, eo.code, crt.total AS totalValue, crt.resets, crt.wraps
+                FROM counter_record_total crt
+                JOIN equipment_output eo ON crt.equipment_output_id = eo.id
+                WHERE crt.production_order_id = %s
+                ORDER BY crt.equipment_output_id
+                """)
+                cursor.execute(get_production_order_totals_query, (production_order_id,))
+                totals_found = cursor.fetchall()
+                return totals_found
+            
+        except Exception as err:
+            logging.error("%s. getCounterRecordTotalValueByProductionOrderId failed", err)
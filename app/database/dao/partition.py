@@ -0,0 +1,74 @@
+import datetime
+import logging
+import re
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+#pg_get_expr of a range partition: FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')
+BOUND_PATTERN = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \((?:'([^']+)'|MAXVALUE)\)")
+
+
+def parse_bound(bound):
+    match = BOUND_PATTERN.search(bound or "")
+    if match is None:
+        return None, None
+    start, end = match.groups()
+    return (datetime.datetime.fromisoformat(start) if start else None,
+            datetime.datetime.fromisoformat(end) if end else None)
+
+
+class PartitionDAO:
+    def __init__(self, connection):
+        self.connection = connection
+
+    #get the partitions of a table with their ranges, the default partition has no range
+    def getPartitions(self, table):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                get_partitions_query = sql.SQL("""
+                SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = %s
+                """)
+                cursor.execute(get_partitions_query, (table,))
+                partitions = []
+                for partition in cursor.fetchall():
+                    start, end = parse_bound(partition['bound'])
+                    partitions.append({"name": partition['name'], "default": partition['bound'] == "DEFAULT", "start": start, "end": end})
+                return partitions
+
+        except Exception as err:
+            logging.error("%s. getPartitions failed", err)
+
+    def createPartition(self, table, name, start, end):
+        try:
+            with self.connection.cursor() as cursor:
+                create_partition_query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)
+                """).format(partition=sql.Identifier(name), table=sql.Identifier(table))
+                cursor.execute(create_partition_query, (start, end))
+                self.connection.commit()
+                print(f"Partition {name} created")
+                return True
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. createPartition failed", err)
+            return False
+
+    def dropPartition(self, table, name):
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(sql.SQL("ALTER TABLE {table} DETACH PARTITION {partition}").format(
+                    table=sql.Identifier(table), partition=sql.Identifier(name)))
+                cursor.execute(sql.SQL("DROP TABLE {partition}").format(partition=sql.Identifier(name)))
+                self.connection.commit()
+                print(f"Partition {name} dropped")
+                return True
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. dropPartition failed", err)
+            return False
@@ -1,6 +1,39 @@
-import json
+import logging
+from psycopg2.extras import RealDictCursor
+
 from database.dao.configuration import ConfigurationDAO  
 from database.dao.productionOrder import ProductionOrderDAO 
+from database.preparedStatements import prepared_statements
+
+#everything a ProductionCount message needs, for several equipment in one query:
+#open production order, last active time, last alarms and the last value of every enabled output
+GET_PRODUCTION_COUNT_SNAPSHOT = prepared_statements.register("get_production_count_snapshot", """
+SELECT ce.id AS equipment_id, ce.code AS equipment_code, ce.equipment_status,
+    COALESCE(po.code, '') AS production_order_code,
+    COALESCE(atl.active_time, 0) AS active_time,
+    ARRAY[COALESCE(a.alarm_0, 0), COALESCE(a.alarm_1, 0), COALESCE(a.alarm_2, 0), COALESCE(a.alarm_3, 0)] AS alarms,
+    COALESCE(c.counters, '[]'::json) AS counters
+FROM counting_equipment ce
+LEFT JOIN LATERAL (
+    SELECT code FROM production_order
+    WHERE equipment_id = ce.id AND finished = 0
+    ORDER BY id DESC LIMIT 1
+) po ON TRUE
+LEFT JOIN active_time_latest atl ON atl.equipment_id = ce.id
+LEFT JOIN LATERAL (
+    SELECT alarm_0, alarm_1, alarm_2, alarm_3 FROM alarm
+    WHERE equipment_id = ce.id
+    ORDER BY id DESC LIMIT 1
+) a ON TRUE
+LEFT JOIN LATERAL (
+    SELECT json_agg(json_build_object('outputCode', eo.code, 'value', COALESCE(crl.real_value, 0)) ORDER BY eo.id) AS counters
+    FROM equipment_output eo
+    LEFT JOIN counter_record_latest crl ON crl.equipment_output_id = eo.id
+    WHERE eo.equipment_id = ce.id AND eo.disable = 0
+) c ON TRUE
+WHERE ce.id = ANY(%s)
+ORDER BY ce.id
+""")
 
 class ProductionCountDAO:
     def __init__(self, connection):
@@ -20,11 +53,19 @@ class ProductionCountDAO:
         for po in pos:
             for ce in counting_equipment:
                 if ce['id'] == po['equipment_id']:
-                    temp_list = json.dumps(po, indent = 4)
-                    temp_list = json.loads(temp_list)
+                    temp_list = dict(po)
                     temp_list.update({"p_timer_communication_cycle": ce['p_timer_communication_cycle']})
                     temp_list.update({"equipment_status": ce['equipment_status']})
                     temp_list.update({"equipment_code": ce['code']})
                     final_pos.append(temp_list)
         return final_pos
 
+    def getProductionCountSnapshot(self, equipment_ids):
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                prepared_statements.execute(cursor, GET_PRODUCTION_COUNT_SNAPSHOT, (list(equipment_ids),))
+                snapshot = cursor.fetchall()
+                return snapshot
+
+        except Exception as err:
+            logging.error("%s. getProductionCountSnapshot failed", err)
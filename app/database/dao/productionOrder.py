@@ -3,6 +3,16 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
+from database.preparedStatements import prepared_statements
+
+GET_PRODUCTION_ORDER_BY_EQUIPMENT_ID_IF_NOT_FINISHED = prepared_statements.register("get_production_order_by_equipment_id_if_not_finished", """
+SELECT *
+FROM production_order
+WHERE equipment_id = %s AND finished = %s
+ORDER BY id DESC
+LIMIT 1
+""")
+
 class ProductionOrderDAO:
     def __init__(self, connection):
         self.connection = connection
@@ -40,13 +50,7 @@ class ProductionOrderDAO:
     def getProductionOrderByCEquipmentIdIfNotFinished(self, equipment_id):
         try:
             with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
-                check_if_PO_exists_query = sql.SQL("""
-                SELECT *
-                FROM production_order
-                WHERE equipment_id = %s AND finished = %s
-                ORDER BY id DESC
-                """)
-                cursor.execute(check_if_PO_exists_query, (equipment_id,0))
+                prepared_statements.execute(cursor, GET_PRODUCTION_ORDER_BY_EQUIPMENT_ID_IF_NOT_FINISHED, (equipment_id,0))
                 po_found = cursor.fetchone()
                 return po_found
             
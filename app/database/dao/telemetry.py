@@ -0,0 +1,268 @@
+import datetime
+import io
+import logging
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from database.preparedStatements import prepared_statements
+from variables import TELEMETRY_COUNTER_WRAP_WINDOW
+
+#a flush with a single row (slow polling, or the insertCounterRecord/insertActiveTime path) uses a prepared statement
+SINGLE_ROW_INSERTS = {
+    "counter_record": prepared_statements.register("insert_counter_record", """
+    INSERT INTO counter_record (equipment_output_id, real_value, registered_at)
+    VALUES (%s, %s, %s)
+    """),
+    "active_time": prepared_statements.register("insert_active_time", """
+    INSERT INTO active_time (equipment_id, active_time, registered_at)
+    VALUES (%s, %s, %s)
+    """),
+}
+
+
+#insertTelemetryBatch result when the database refused the rows themselves (a value that doesn't fit its
+#column, a key that no longer exists): retrying the same batch would fail again
+BATCH_REJECTED = "rejected"
+#counter_record.real_value and active_time.active_time are BIGINT
+BIGINT_MIN, BIGINT_MAX = -(1 << 63), (1 << 63) - 1
+
+
+#PLC value -> value for a BIGINT column. REAL values are rounded, values that don't fit are None
+def bigint_value(value):
+    if isinstance(value, float):
+        if value != value or value in (float("inf"), float("-inf")):
+            return None
+        value = round(value)
+    value = int(value)
+    return value if BIGINT_MIN <= value <= BIGINT_MAX else None
+
+
+#rows with their value ready for the BIGINT column. Rows whose value doesn't fit are logged and left out
+def bigint_rows(table, rows):
+    converted = []
+    for row in rows:
+        value = bigint_value(row[1]) if row[1] is not None else None
+        if value is None and row[1] is not None:
+            logging.error("%s value %s of %s doesn't fit a BIGINT. The row was dropped", table, row[1], row[0])
+            continue
+        converted.append((row[0], value) + tuple(row[2:]))
+    return converted
+
+
+def copy_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    return str(value)
+
+
+#rows in COPY text format, built in memory
+def copy_buffer(rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+#typed VALUES for the alarm statements: a column that is None in every row would otherwise be text
+ALARM_TEMPLATE = "(%s::integer, %s::integer, %s::integer, %s::integer, %s::integer, %s::timestamp)"
+
+
+#BOOL alarm variables are read as bools, the alarm columns are integers
+def alarm_row(alarm):
+    return tuple(int(value) if isinstance(value, bool) else value for value in alarm)
+
+
+COUNTER_RESET = "reset"
+COUNTER_WRAP = "wrap"
+#keys without a known PLC type are the default UINT counters
+DEFAULT_COUNTER_WRAP = 1 << 16
+
+
+#how much a PLC counter moved between two readings. When it went back it either wrapped around
+#(it was below the wrap point and the distance through the wrap fits in wrap_window) or was reset,
+#and then it counted from 0. wrap is 0 for types that don't wrap
+def counter_delta(last_value, value, wrap=DEFAULT_COUNTER_WRAP, wrap_window=4096):
+    if last_value is None:
+        return 0, None
+    if value >= last_value:
+        return value - last_value, None
+    if wrap and last_value < wrap and 0 < value + wrap - last_value <= wrap_window:
+        return value + wrap - last_value, COUNTER_WRAP
+    return max(value, 0), COUNTER_RESET
+
+
+#(key, value, registered_at, production order) rows -> (key, production order, total, resets, wraps, updated at)
+#increments, for the lifetime total (production order 0) and for the production order that was open when each
+#row was read. last_values has the last value of every key, and is updated.
+#wraps has the wrap point of the keys (from the PLC data type)
+def running_totals(rows, last_values, wraps=None, wrap_window=4096):
+    wraps = wraps or {}
+    totals = {}
+    for key, value, registered_at, production_order_id in sorted(rows, key=lambda row: row[2]):
+        if value is None:
+            continue
+        delta, change = counter_delta(last_values.get(key), value, wraps.get(key, DEFAULT_COUNTER_WRAP), wrap_window)
+        last_values[key] = value
+
+        for scope in {0, production_order_id or 0}:
+            entry = totals.setdefault((key, scope), [0, 0, 0, registered_at])
+            entry[0] += delta
+            entry[1] += change == COUNTER_RESET
+            entry[2] += change == COUNTER_WRAP
+            entry[3] = max(entry[3], registered_at)
+    return [key + tuple(entry) for key, entry in totals.items()]
+
+
+#last stored value of the keys of a batch, read before the latest values are replaced
+RUNNING_TOTAL_LOOKUPS = {
+    "counter_record": """
+    SELECT equipment_output_id, real_value
+    FROM counter_record_latest
+    WHERE equipment_output_id = ANY(%s)
+    """,
+    "active_time": """
+    SELECT equipment_id, active_time
+    FROM active_time_latest
+    WHERE equipment_id = ANY(%s)
+    """,
+}
+
+
+#production order open now on the key of a single row insert (insertCounterRecord/insertActiveTime)
+OPEN_PRODUCTION_ORDER_LOOKUPS = {
+    "counter_record": """
+    SELECT po.id
+    FROM equipment_output eo
+    JOIN production_order po ON po.equipment_id = eo.equipment_id AND po.finished = 0
+    WHERE eo.id = %s
+    ORDER BY po.id DESC
+    LIMIT 1
+    """,
+    "active_time": """
+    SELECT id
+    FROM production_order
+    WHERE equipment_id = %s AND finished = 0
+    ORDER BY id DESC
+    LIMIT 1
+    """,
+}
+
+
+class TelemetryDAO:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def getOpenProductionOrderId(self, table, key):
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(OPEN_PRODUCTION_ORDER_LOOKUPS[table], (key,))
+                production_order = cursor.fetchone()
+                return production_order[0] if production_order else 0
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. getOpenProductionOrderId failed", err)
+            return 0
+
+    def updateRunningTotals(self, cursor, table, key_column, rows, wraps=None):
+        cursor.execute(RUNNING_TOTAL_LOOKUPS[table], (list({row[0] for row in rows}),))
+        last_values = dict(cursor.fetchall())
+        totals = running_totals(rows, last_values, wraps, int(TELEMETRY_COUNTER_WRAP_WINDOW))
+        if not totals:
+            return
+
+        execute_values(cursor, sql.SQL("""
+        INSERT INTO {table} AS t ({key}, production_order_id, total, resets, wraps, updated_at)
+        VALUES %s
+        ON CONFLICT ({key}, production_order_id) DO UPDATE
+        SET total = t.total + EXCLUDED.total,
+            resets = t.resets + EXCLUDED.resets,
+            wraps = t.wraps + EXCLUDED.wraps,
+            updated_at = GREATEST(t.updated_at, EXCLUDED.updated_at)
+        """).format(table=sql.Identifier(f"{table}_total"), key=sql.Identifier(key_column)), totals)
+
+    def insertRows(self, cursor, table, columns, rows, use_copy):
+        if len(rows) == 1 and table in SINGLE_ROW_INSERTS:
+            prepared_statements.execute(cursor, SINGLE_ROW_INSERTS[table], rows[0])
+        elif use_copy:
+            copy_query = sql.SQL("COPY {table} ({columns}) FROM STDIN").format(
+                table=sql.Identifier(table), columns=sql.SQL(", ").join(map(sql.Identifier, columns)))
+            cursor.copy_expert(copy_query.as_string(cursor), copy_buffer(rows))
+        else:
+            insert_query = sql.SQL("INSERT INTO {table} ({columns}) VALUES %s").format(
+                table=sql.Identifier(table), columns=sql.SQL(", ").join(map(sql.Identifier, columns)))
+            execute_values(cursor, insert_query, rows, page_size=1000)
+
+    #insert the counter records, active times and alarms of one or more poll cycles in a single transaction
+    #and keep the running totals and the latest values up to date.
+    #with use_copy the raw rows are streamed with COPY FROM STDIN, the rest is already one row per key.
+    #counter_records and active_times are (key, value, registered_at, production order open when read) rows.
+    #wraps has the counter wrap point per key of each table ({"counter_record": {id: wrap}, ...})
+    def insertTelemetryBatch(self, counter_records, active_times, alarms, use_copy=False, wraps=None):
+        wraps = wraps or {}
+        counter_records = bigint_rows("counter_record", counter_records)
+        active_times = bigint_rows("active_time", active_times)
+        try:
+            with self.connection.cursor() as cursor:
+                if counter_records:
+                    #before the latest values are replaced, they are the starting point of the running totals
+                    self.updateRunningTotals(cursor, "counter_record", "equipment_output_id", counter_records, wraps.get("counter_record"))
+                    counter_records = [row[:3] for row in counter_records]
+                    self.insertRows(cursor, "counter_record", ("equipment_output_id", "real_value", "registered_at"), counter_records, use_copy)
+
+                    #one row per output, the latest of the batch, or the upsert would touch the same row twice
+                    execute_values(cursor, """
+                    INSERT INTO counter_record_latest (equipment_output_id, real_value, registered_at)
+                    VALUES %s
+                    ON CONFLICT (equipment_output_id) DO UPDATE
+                    SET real_value = EXCLUDED.real_value, registered_at = EXCLUDED.registered_at
+                    WHERE counter_record_latest.registered_at IS NULL OR counter_record_latest.registered_at <= EXCLUDED.registered_at
+                    """, list({row[0]: row for row in counter_records}.values()))
+
+                if active_times:
+                    self.updateRunningTotals(cursor, "active_time", "equipment_id", active_times, wraps.get("active_time"))
+                    active_times = [row[:3] for row in active_times]
+                    self.insertRows(cursor, "active_time", ("equipment_id", "active_time", "registered_at"), active_times, use_copy)
+
+                    execute_values(cursor, """
+                    INSERT INTO active_time_latest (equipment_id, active_time, registered_at)
+                    VALUES %s
+                    ON CONFLICT (equipment_id) DO UPDATE
+                    SET active_time = EXCLUDED.active_time, registered_at = EXCLUDED.registered_at
+                    WHERE active_time_latest.registered_at IS NULL OR active_time_latest.registered_at <= EXCLUDED.registered_at
+                    """, list({row[0]: row for row in active_times}.values()))
+
+                if alarms:
+                    alarms = [alarm_row(alarm) for alarm in alarms]
+                    execute_values(cursor, """
+                    UPDATE alarm
+                    SET alarm_0 = v.alarm_0, alarm_1 = v.alarm_1, alarm_2 = v.alarm_2, alarm_3 = v.alarm_3, registered_at = v.registered_at
+                    FROM (VALUES %s) AS v (equipment_id, alarm_0, alarm_1, alarm_2, alarm_3, registered_at)
+                    WHERE alarm.equipment_id = v.equipment_id
+                    """, alarms, template=ALARM_TEMPLATE)
+
+                    execute_values(cursor, """
+                    INSERT INTO alarm (equipment_id, alarm_0, alarm_1, alarm_2, alarm_3, registered_at)
+                    SELECT v.equipment_id, v.alarm_0, v.alarm_1, v.alarm_2, v.alarm_3, v.registered_at
+                    FROM (VALUES %s) AS v (equipment_id, alarm_0, alarm_1, alarm_2, alarm_3, registered_at)
+                    WHERE NOT EXISTS (SELECT 1 FROM alarm WHERE alarm.equipment_id = v.equipment_id)
+                    """, alarms, template=ALARM_TEMPLATE)
+
+                self.connection.commit()
+                print(f"Telemetry batch inserted: {len(counter_records)} counter records, {len(active_times)} active times, {len(alarms)} alarms")
+                return True
+
+        except (psycopg2.DataError, psycopg2.IntegrityError) as err:
+            self.connection.rollback()
+            logging.error("%s. insertTelemetryBatch rejected the batch", err)
+            return BATCH_REJECTED
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. insertTelemetryBatch failed", err)
+            return False
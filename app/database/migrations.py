@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import os
+
+from psycopg2.extras import RealDictCursor
+
+from variables import DB_VERSION
+
+SQL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sql")
+
+#any number, it only has to be the same for every gateway sharing the database
+MIGRATION_LOCK_ID = 1001
+
+#queries run on every poll, message or telemetry flush (as the DAOs run them), with the indexes that should serve them
+HOT_QUERIES = [
+    ("last counter record by output", "counter_record_latest_pkey",
+     "SELECT * FROM counter_record_latest WHERE equipment_output_id = %s", (0,)),
+    ("last counter records by equipment", "equipment_output_equipment_idx, counter_record_latest_pkey",
+     """SELECT eo.id AS equipment_output_id, eo.code, COALESCE(crl.real_value, 0) AS real_value
+     FROM equipment_output eo
+     LEFT JOIN counter_record_latest crl ON crl.equipment_output_id = eo.id
+     WHERE eo.equipment_id = %s AND eo.disable = %s
+     ORDER BY eo.id""", (0, 0)),
+    ("last active time by equipment", "active_time_latest_pkey",
+     "SELECT * FROM active_time_latest WHERE equipment_id = %s", (0,)),
+    ("alarm by equipment", "alarm_equipment_id_idx",
+     "SELECT * FROM alarm WHERE equipment_id = %s ORDER BY id DESC LIMIT 1", (0,)),
+    ("open production order by equipment", "production_order_equipment_finished_idx",
+     "SELECT * FROM production_order WHERE equipment_id = %s AND finished = %s ORDER BY id DESC LIMIT 1", (0, 0)),
+    ("counter record total by output", "counter_record_total_pkey",
+     """SELECT crt.equipment_output_id, crt.total AS totalValue
+     FROM counter_record_total crt
+     JOIN equipment_output eo ON crt.equipment_output_id = eo.id
+     WHERE crt.equipment_output_id = %s AND crt.production_order_id = %s AND eo.disable = %s""", (0, 0, 0)),
+    ("active time total by equipment", "active_time_total_pkey",
+     "SELECT att.equipment_id, att.total AS totalActiveValue FROM active_time_total att WHERE att.equipment_id = %s AND att.production_order_id = %s", (0, 0)),
+    ("counter record totals by production order", "counter_record_total_production_order_idx",
+     """SELECT crt.equipment_output_id, eo.code, crt.total AS totalValue, crt.resets, crt.wraps
+     FROM counter_record_total crt
+     JOIN equipment_output eo ON crt.equipment_output_id = eo.id
+     WHERE crt.production_order_id = %s
+     ORDER BY crt.equipment_output_id""", (0,)),
+    ("active time total by production order", "active_time_total_production_order_idx",
+     "SELECT equipment_id, total AS totalActiveValue, resets, wraps FROM active_time_total WHERE production_order_id = %s", (0,)),
+]
+
+
+def version_key(version):
+    return tuple(int(part) for part in version.split("."))
+
+
+def list_versions(folder, max_version=DB_VERSION):
+    path = os.path.join(SQL_PATH, folder)
+    if not os.path.isdir(path):
+        return []
+    versions = [version for version in os.listdir(path) if os.path.isdir(os.path.join(path, version))]
+    return sorted((version for version in versions if version_key(version) <= version_key(max_version)), key=version_key)
+
+
+def read_script(*path):
+    with open(os.path.join(SQL_PATH, *path), encoding="utf-8") as script:
+        return script.read()
+
+
+class MigrationRunner:
+    """
+    Brings the database schema up to DB_VERSION.
+
+    An empty database is created with the persistence scripts of the oldest
+    version. Then every script of sql/version/<version>/ up to DB_VERSION that
+    isn't in audit_script yet is applied in file name order, each one in its
+    own transaction. The scripts insert their own audit_script row.
+    """
+
+    def __init__(self, connection, version=DB_VERSION):
+        self.connection = connection
+        self.version = version
+
+    def tableExists(self, cursor, table):
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS found", (table,))
+        return cursor.fetchone()['found']
+
+    def getAppliedScripts(self, cursor):
+        cursor.execute("SELECT process FROM audit_script")
+        return {row['process'] for row in cursor.fetchall()}
+
+    def createSchema(self, cursor):
+        if self.tableExists(cursor, "counting_equipment"):
+            #create_all_tables drops the tables first, never run it on a database with data
+            raise Exception("Database has tables but no audit_script. Apply the missing scripts manually")
+
+        versions = list_versions("persistence", self.version)
+        if not versions:
+            raise Exception(f"No persistence scripts found for version {self.version}")
+        cursor.execute(read_script("persistence", versions[0], "create_all_tables.sql"))
+        print(f"Database schema {versions[0]} created")
+
+    def getPendingScripts(self, applied):
+        pending = []
+        for version in list_versions("version", self.version):
+            for script in sorted(os.listdir(os.path.join(SQL_PATH, "version", version))):
+                if script.endswith(".sql") and script not in applied:
+                    pending.append((version, script))
+        return pending
+
+    def migrate(self):
+        applied_now = []
+        try:
+            with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                #only one gateway migrates at a time, the others wait and find nothing left to do
+                cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+                try:
+                    if not self.tableExists(cursor, "audit_script"):
+                        self.createSchema(cursor)
+                        self.connection.commit()
+
+                    for version, script in self.getPendingScripts(self.getAppliedScripts(cursor)):
+                        print(f"Applying {version}/{script}")
+                        cursor.execute(read_script("version", version, script))
+                        self.connection.commit()
+                        applied_now.append(script)
+                finally:
+                    self.connection.rollback()
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+                    self.connection.commit()
+
+            print(f"Database schema is up to date ({len(applied_now)} scripts applied)")
+            return applied_now
+
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. migrate failed", err)
+            raise
+
+    def checkQueryPlans(self):
+        """
+        Runs EXPLAIN on the hot queries and reports if they can use their index.
+        Sequential scans are disabled for the check, because on small tables the
+        planner prefers them even when the index exists.
+        """
+        report = []
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                for name, index, query, params in HOT_QUERIES:
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                    plan = cursor.fetchone()[0]
+                    plan = plan[0]['Plan'] if isinstance(plan, list) else json.loads(plan)[0]['Plan']
+                    #on partitioned tables every partition has its own copy of the index, so any index scan without a seq scan counts
+                    report.append({"query": name, "index": index, "usesIndex": not has_seq_scan(plan) and any(plan_indexes(plan)), "plan": plan_summary(plan)})
+            self.connection.rollback()
+        except Exception as err:
+            self.connection.rollback()
+            logging.error("%s. checkQueryPlans failed", err)
+            return report
+
+        for entry in report:
+            if entry['usesIndex']:
+                print(f"{entry['query']}: {entry['plan']}")
+            else:
+                logging.warning("%s is not using %s: %s", entry['query'], entry['index'], entry['plan'])
+        return report
+
+
+def plan_indexes(plan):
+    if 'Index Name' in plan:
+        yield plan['Index Name']
+    for child in plan.get('Plans', []):
+        yield from plan_indexes(child)
+
+
+def has_seq_scan(plan):
+    return plan['Node Type'] == 'Seq Scan' or any(has_seq_scan(child) for child in plan.get('Plans', []))
+
+
+def plan_summary(plan):
+    node = plan['Node Type']
+    if 'Index Name' in plan:
+        node += f" using {plan['Index Name']}"
+    elif 'Relation Name' in plan:
+        node += f" on {plan['Relation Name']}"
+    children = [plan_summary(child) for child in plan.get('Plans', [])]
+    return node + (f" ({', '.join(children)})" if children else "")
+
+
+def main():
+    from database.connectionPool import db_pool
+
+    parser = argparse.ArgumentParser(description="Apply the database migrations up to DB_VERSION.")
+    parser.add_argument("--check", action="store_true", help="only report the query plans of the hot queries")
+    args = parser.parse_args()
+
+    try:
+        with db_pool.connection() as conn:
+            runner = MigrationRunner(conn)
+            if not args.check:
+                runner.migrate()
+            runner.checkQueryPlans()
+    finally:
+        db_pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
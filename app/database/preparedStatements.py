@@ -0,0 +1,71 @@
+import logging
+import re
+import threading
+import weakref
+
+import psycopg2
+
+from variables import DB_PREPARED_STATEMENTS
+
+PLACEHOLDER = re.compile(r"%s")
+
+
+class PreparedStatementRegistry:
+    """
+    Named server-side prepared statements for the queries run on every poll or
+    message, so Postgres parses and plans them once per connection instead of
+    on every call.
+
+    DAOs register a query once (with the usual %s placeholders) and run it with
+    execute(cursor, name, params). A statement is prepared the first time it is
+    used on a connection; the prepared names are kept per connection object, so
+    a new connection (after a reconnect, or a broken one replaced by the pool)
+    prepares them again.
+
+    With enabled=False the queries are sent as plain text, which is needed
+    behind a pooler that doesn't keep sessions, like pgbouncer in transaction
+    mode.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.statements = {}
+        self.prepared = weakref.WeakKeyDictionary()
+
+    def register(self, name, query):
+        numbered = iter(range(1, query.count("%s") + 1))
+        self.statements[name] = (query, PLACEHOLDER.sub(lambda _: f"${next(numbered)}", query))
+        return name
+
+    def _prepared_names(self, connection):
+        with self.lock:
+            names = self.prepared.get(connection)
+            if names is None:
+                names = self.prepared[connection] = set()
+            return names
+
+    def execute(self, cursor, name, params=()):
+        query, numbered_query = self.statements[name]
+        if not self.enabled:
+            cursor.execute(query, params)
+            return
+
+        names = self._prepared_names(cursor.connection)
+        if name not in names:
+            cursor.execute(f"PREPARE {name} AS {numbered_query}")
+            names.add(name)
+
+        try:
+            if params:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except psycopg2.errors.InvalidSqlStatementName:
+            #the session lost it (DISCARD ALL, server side pooler...): prepare it again next time
+            logging.warning("Prepared statement %s was lost. It will be prepared again", name)
+            names.discard(name)
+            raise
+
+
+prepared_statements = PreparedStatementRegistry(bool(int(DB_PREPARED_STATEMENTS)))
@@ -13,8 +13,22 @@ certfile = certfile
 keyfile = keyfile
 
 import api.publishSubscriberMES
+from database.connectionPool import db_pool
+from database.migrations import MigrationRunner
 
 def main():
+    #bring the database schema up to DB_VERSION before anything reads or writes it
+    try:
+        with db_pool.connection() as conn:
+            migration_runner = MigrationRunner(conn)
+            migration_runner.migrate()
+            migration_runner.checkQueryPlans()
+    except Exception as err:
+        #without the migrated schema every DAO call and telemetry flush would fail
+        logging.error("%s. Database migration failed. Stopping", err)
+        db_pool.close_all()
+        sys.exit(1)
+
     #MQTT client initialization
     reconnect_count, reconnect_delay = 0, int(FIRST_RECONNECT_DELAY)
 
@@ -0,0 +1,63 @@
+import logging
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "halfOpen"
+
+
+class CircuitBreaker:
+    """
+    Stops talking to a PLC after failure_threshold consecutive failures.
+
+    While open, requests are refused straight away. After the backoff one probe
+    is let through (half-open): if it works the breaker closes again, if it
+    fails the breaker opens again with twice the backoff, up to max_backoff.
+    """
+
+    def __init__(self, name, failure_threshold=3, backoff=5, max_backoff=300, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = backoff
+        self.retry_at = 0
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() >= self.retry_at:
+                self.state = HALF_OPEN
+                logging.info("PLC %s: trying again after %ss", self.name, self.backoff)
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logging.info("PLC %s is reachable again", self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self.backoff = self.base_backoff
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            elif self.failures < self.failure_threshold:
+                return
+            self.state = OPEN
+            self.retry_at = self.clock() + self.backoff
+            logging.warning("PLC %s is unreachable. Next try in %ss", self.name, self.backoff)
+
+    @property
+    def is_open(self):
+        with self.lock:
+            return self.state != CLOSED
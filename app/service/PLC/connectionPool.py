@@ -0,0 +1,100 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+from service.PLC.circuitBreaker import CircuitBreaker
+from service.PLC.snap7 import plc_connect, plc_disconnect
+from variables import PLC_TIMEOUT, PLC_BREAKER_FAILURES, PLC_BREAKER_BACKOFF, PLC_BREAKER_MAX_BACKOFF
+
+
+class PLCConnectionPool:
+    """
+    Keeps one long-lived snap7 client per PLC address.
+
+    Clients are connected lazily on first use, checked before every use and
+    reconnected when the PLC dropped the connection. A snap7 client is not
+    thread safe, so every address has its own lock and callers of the same PLC
+    are serialized while they hold the connection.
+
+    Every address also has a circuit breaker: while it is open the PLC is
+    considered offline and connection() yields None without trying to connect.
+    """
+
+    def __init__(self, connect=plc_connect, disconnect=plc_disconnect, create_breaker=CircuitBreaker):
+        self.connect = connect
+        self.disconnect = disconnect
+        self.create_breaker = create_breaker
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def _get_entry(self, plc_ip):
+        with self.lock:
+            entry = self.connections.get(plc_ip)
+            if entry is None:
+                entry = {"plc": None, "lock": threading.Lock(), "breaker": self.create_breaker(plc_ip)}
+                self.connections[plc_ip] = entry
+            return entry
+
+    def is_healthy(self, plc):
+        try:
+            return plc.get_connected()
+        except Exception:
+            return False
+
+    def _drop(self, entry):
+        if entry['plc'] is not None:
+            self.disconnect(entry['plc'])
+            entry['plc'] = None
+
+    @contextmanager
+    def connection(self, plc_ip):
+        """
+        Borrow the client for plc_ip. Yields None when the PLC can't be reached,
+        like plc_connect does.
+        """
+        entry = self._get_entry(plc_ip)
+        breaker = entry['breaker']
+
+        #checked before taking the lock, so callers of an offline PLC never wait for a connect timeout
+        if not breaker.allow():
+            yield None
+            return
+
+        with entry['lock']:
+            if entry['plc'] is not None and not self.is_healthy(entry['plc']):
+                logging.warning("Connection to PLC %s lost. Reconnecting...", plc_ip)
+                self._drop(entry)
+
+            if entry['plc'] is None:
+                entry['plc'] = self.connect(plc_ip)
+                if entry['plc'] is None:
+                    breaker.record_failure()
+
+            try:
+                yield entry['plc']
+            except Exception:
+                #after a failed request we can't trust the session state, so the next use reconnects
+                self._drop(entry)
+                breaker.record_failure()
+                raise
+
+            if entry['plc'] is not None:
+                breaker.record_success()
+
+    def close(self, plc_ip):
+        with self.lock:
+            entry = self.connections.pop(plc_ip, None)
+        if entry is not None:
+            with entry['lock']:
+                self._drop(entry)
+
+    def close_all(self):
+        with self.lock:
+            plc_ips = list(self.connections)
+        for plc_ip in plc_ips:
+            self.close(plc_ip)
+
+
+plc_pool = PLCConnectionPool(
+    connect=lambda plc_ip: plc_connect(plc_ip, timeout=int(PLC_TIMEOUT)),
+    create_breaker=lambda plc_ip: CircuitBreaker(plc_ip, int(PLC_BREAKER_FAILURES), float(PLC_BREAKER_BACKOFF), float(PLC_BREAKER_MAX_BACKOFF)))
@@ -0,0 +1,61 @@
+import threading
+import time
+import weakref
+
+
+class ProcessImage:
+    """
+    Last bytes read from each DB block of one PLC connection, with the time
+    each block was last read in full.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.blocks = {}
+        self.updated_at = {}
+
+    def update(self, db_number, start, buffer):
+        end = start + len(buffer)
+        now = self.clock()
+        with self.lock:
+            #patch every block that overlaps, so no block keeps an older copy of these bytes
+            covered = False
+            for (block_db_number, block_start), block in self.blocks.items():
+                if block_db_number != db_number:
+                    continue
+                low, high = max(start, block_start), min(end, block_start + len(block))
+                if low < high:
+                    block[low - block_start:high - block_start] = buffer[low - start:high - start]
+                    covered = covered or (block_start <= start and end <= block_start + len(block))
+                    #only a block read in full is fresh, the rest of a patched block keeps its age
+                    if start <= block_start and block_start + len(block) <= end:
+                        self.updated_at[(block_db_number, block_start)] = now
+            if not covered:
+                self.blocks[(db_number, start)] = bytearray(buffer)
+                self.updated_at[(db_number, start)] = now
+
+    def get_byte(self, db_number, byte_offset, max_age=None):
+        #None when the byte was never read, or when it is older than max_age seconds
+        now = self.clock()
+        with self.lock:
+            for (block_db_number, start), buffer in self.blocks.items():
+                if block_db_number != db_number or not start <= byte_offset < start + len(buffer):
+                    continue
+                if max_age is not None and now - self.updated_at[(block_db_number, start)] > max_age:
+                    continue
+                return buffer[byte_offset - start]
+        return None
+
+
+#one image per client, so a reconnected client starts with an empty image
+process_images = weakref.WeakKeyDictionary()
+process_images_lock = threading.Lock()
+
+
+def get_process_image(plc):
+    with process_images_lock:
+        image = process_images.get(plc)
+        if image is None:
+            image = process_images[plc] = ProcessImage()
+        return image
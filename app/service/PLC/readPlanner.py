@@ -0,0 +1,249 @@
+import logging
+import struct
+import threading
+
+import snap7
+
+from service.PLC.processImage import get_process_image
+from service.PLC.snap7 import read_multiple_variables
+
+# S7 protocol overhead (in bytes) that has to fit inside the negotiated PDU together with the data
+READ_AREA_OVERHEAD = 18
+MULTI_READ_REQUEST_HEADER = 19
+MULTI_READ_REQUEST_ITEM = 12
+MULTI_READ_RESPONSE_HEADER = 21
+MULTI_READ_RESPONSE_ITEM = 4
+# snap7 refuses more items than this in a single read_multi_vars
+MAX_ITEMS_PER_REQUEST = 20
+# bytes between two variables of the same DB that are still cheaper to read than to split the range
+MAX_MERGE_GAP = 16
+# smallest PDU an S7 PLC can negotiate, used when the client does not tell us
+DEFAULT_PDU_SIZE = 240
+
+# struct codes (big-endian, like the PLC) of the equipment_variable.data_type values
+DATA_TYPES = {
+    "BOOL": "B",
+    "INT": "h",
+    "UINT": "H",
+    "DINT": "i",
+    "UDINT": "I",
+    "REAL": "f"
+}
+
+
+# where the PLC counters of each integer type wrap around (REAL and BOOL never wrap)
+COUNTER_WRAPS = {
+    "INT": 1 << 16,
+    "UINT": 1 << 16,
+    "DINT": 1 << 32,
+    "UDINT": 1 << 32
+}
+
+
+def get_data_type(equipment_var):
+    data_type = equipment_var.get('data_type')
+    if data_type:
+        return data_type.upper()
+    # rows from before data_type existed: isEquipmentEnabled is the only bool, everything else is a 16-bit uint
+    if equipment_var['name'] == "isEquipmentEnabled":
+        return "BOOL"
+    return "UINT"
+
+
+def counter_wrap(equipment_var):
+    return COUNTER_WRAPS.get(get_data_type(equipment_var), 0)
+
+
+def variable_size(equipment_var):
+    return struct.calcsize(">" + DATA_TYPES[get_data_type(equipment_var)])
+
+
+def get_pdu_size(plc):
+    try:
+        return plc.get_pdu_length() or DEFAULT_PDU_SIZE
+    except Exception:
+        return DEFAULT_PDU_SIZE
+
+
+def build_read_plan(equipment_variables, pdu_size=DEFAULT_PDU_SIZE):
+    """
+    Group the equipment variables into as few PLC requests as the PDU allows.
+
+    Args:
+    - equipment_variables: rows from equipment_variable (db_address, offset_byte, offset_bit, name, data_type).
+    - pdu_size: PDU length negotiated with the PLC.
+
+    Returns:
+    - List of requests. Each request is a list of blocks
+      {"db_number", "start", "size", "variables": [(index, equipment_var, relative_offset)]}
+      where index is the position of the variable in equipment_variables.
+    """
+    max_block_size = pdu_size - READ_AREA_OVERHEAD
+
+    ranges = []
+    for index, equipment_var in enumerate(equipment_variables):
+        db_number = int(equipment_var['db_address'])
+        start = int(equipment_var['offset_byte'])
+        ranges.append((db_number, start, start + variable_size(equipment_var), index, equipment_var))
+    ranges.sort(key=lambda item: (item[0], item[1]))
+
+    #merge adjacent (or close enough) ranges of the same DB into blocks
+    blocks = []
+    for db_number, start, end, index, equipment_var in ranges:
+        block = blocks[-1] if blocks else None
+        if (block is not None and block['db_number'] == db_number
+                and start - (block['start'] + block['size']) <= MAX_MERGE_GAP
+                and max(end, block['start'] + block['size']) - block['start'] <= max_block_size):
+            block['size'] = max(end, block['start'] + block['size']) - block['start']
+        else:
+            block = {"db_number": db_number, "start": start, "size": end - start, "variables": []}
+            blocks.append(block)
+        block['variables'].append((index, equipment_var, start - block['start']))
+
+    #pack the blocks into read_multi_vars requests that fit in one PDU each
+    requests = []
+    request, request_size, response_size = [], MULTI_READ_REQUEST_HEADER, MULTI_READ_RESPONSE_HEADER
+    for block in blocks:
+        block_response = MULTI_READ_RESPONSE_ITEM + block['size'] + block['size'] % 2
+        if request and (len(request) == MAX_ITEMS_PER_REQUEST
+                        or request_size + MULTI_READ_REQUEST_ITEM > pdu_size
+                        or response_size + block_response > pdu_size):
+            requests.append(request)
+            request, request_size, response_size = [], MULTI_READ_REQUEST_HEADER, MULTI_READ_RESPONSE_HEADER
+        request.append(block)
+        request_size += MULTI_READ_REQUEST_ITEM
+        response_size += block_response
+    if request:
+        requests.append(request)
+
+    return requests
+
+
+def compile_block_decoder(block_variables):
+    """
+    Build the struct formats that decode all the variables of a block at once.
+
+    Variables are laid side by side (with pad bytes between them) in one format.
+    Variables that overlap an earlier one, like two bits of the same byte, go to
+    another format over the same buffer.
+
+    Returns:
+    - List of (struct.Struct, [(index, bit_mask)]). bit_mask is None for non-bool variables.
+    """
+    layers = []
+    for index, equipment_var, relative_offset in sorted(block_variables, key=lambda item: item[2]):
+        data_type = get_data_type(equipment_var)
+        mask = 1 << int(equipment_var['offset_bit']) if data_type == "BOOL" else None
+
+        layer = next((layer for layer in layers if layer['end'] <= relative_offset), None)
+        if layer is None:
+            layer = {"format": ">", "end": 0, "slots": []}
+            layers.append(layer)
+
+        if relative_offset > layer['end']:
+            layer['format'] += f"{relative_offset - layer['end']}x"
+        layer['format'] += DATA_TYPES[data_type]
+        layer['end'] = relative_offset + variable_size(equipment_var)
+        layer['slots'].append((index, mask))
+
+    return [(struct.Struct(layer['format']), layer['slots']) for layer in layers]
+
+
+class ReadPlan:
+    """
+    Everything needed to poll one equipment, worked out once: the PLC requests,
+    a decoder for every variable and which variables are alarms, outputs and
+    status values.
+    """
+
+    def __init__(self, equipment_variables, pdu_size=DEFAULT_PDU_SIZE):
+        self.pdu_size = pdu_size
+        self.size = len(equipment_variables)
+        self.requests = []
+
+        for request in build_read_plan(equipment_variables, pdu_size):
+            items = [(block['db_number'], block['start'], block['size']) for block in request]
+            decoders = [compile_block_decoder(block['variables']) for block in request]
+            self.requests.append((items, decoders))
+
+        #classify the variables by name once, instead of on every cycle
+        self.alarm_slots = [(index, equipment_var['name']) for index, equipment_var in enumerate(equipment_variables) if 'alarm' in equipment_var['name']]
+        self.output_slots = [index for index, equipment_var in enumerate(equipment_variables) if 'output' in equipment_var['name']]
+        status_slots = [(index, equipment_var['name']) for index, equipment_var in enumerate(equipment_variables)
+                        if 'alarm' not in equipment_var['name'] and 'output' not in equipment_var['name']]
+        self.active_time_slot = next((index for index, name in status_slots if name == 'activeTime'), None)
+        self.equipment_status_slot = next((index for index, name in status_slots if name == 'equipmentStatus'), None)
+        #the running totals need to know where each counter wraps around
+        self.output_wraps = [counter_wrap(equipment_variables[index]) for index in self.output_slots]
+        self.active_time_wrap = counter_wrap(equipment_variables[self.active_time_slot]) if self.active_time_slot is not None else 0
+
+    def read(self, plc):
+        values = [None] * self.size
+        image = get_process_image(plc)
+
+        for items, decoders in self.requests:
+            if len(items) == 1:
+                db_number, start, size = items[0]
+                buffers = [plc.read_area(snap7.types.Areas.DB, db_number, start, size)]
+            else:
+                buffers = read_multiple_variables(plc, items)
+
+            #keep the raw bytes, bit writes are masked against them
+            for (db_number, start, size), buffer in zip(items, buffers):
+                image.update(db_number, start, buffer)
+
+            for buffer, block_decoders in zip(buffers, decoders):
+                for unpacker, slots in block_decoders:
+                    for (index, mask), value in zip(slots, unpacker.unpack_from(buffer)):
+                        values[index] = value if mask is None else bool(value & mask)
+
+        return values
+
+    def execute(self, plc):
+        """
+        Read the equipment from the PLC.
+
+        Returns:
+        - {"alarms": {name: value}, "outputs": [value], "activeTime": value, "equipmentStatus": value,
+           "outputWraps": [wrap], "activeTimeWrap": wrap}
+        """
+        values = self.read(plc)
+        return {
+            "alarms": {name: values[index] for index, name in self.alarm_slots},
+            "outputs": [values[index] for index in self.output_slots],
+            "activeTime": values[self.active_time_slot] if self.active_time_slot is not None else 0,
+            "equipmentStatus": values[self.equipment_status_slot] if self.equipment_status_slot is not None else None,
+            "outputWraps": self.output_wraps,
+            "activeTimeWrap": self.active_time_wrap
+        }
+
+
+class ReadPlanCache:
+    """
+    Compiled read plans per equipment. A plan is only rebuilt after
+    invalidate() (a Configuration message changed the equipment) or when the
+    PLC negotiated a different PDU size.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.plans = {}
+
+    def get(self, equipment_id, load_equipment_variables, pdu_size=DEFAULT_PDU_SIZE):
+        with self.lock:
+            plan = self.plans.get(equipment_id)
+        if plan is not None and plan.pdu_size == pdu_size:
+            return plan
+
+        plan = ReadPlan(load_equipment_variables(), pdu_size)
+        logging.info("Read plan compiled for equipment %s: %d request(s)", equipment_id, len(plan.requests))
+        with self.lock:
+            self.plans[equipment_id] = plan
+        return plan
+
+    def invalidate(self, equipment_id):
+        with self.lock:
+            self.plans.pop(equipment_id, None)
+
+
+read_plan_cache = ReadPlanCache()
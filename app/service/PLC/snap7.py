@@ -1,73 +1,80 @@
+import ctypes
 import snap7
 
-# Set the PLC IP, rack, and slot here
+# Default PLC IP, rack, and slot (the IP of each equipment comes from counting_equipment.plc_ip)
 plc_ip = "192.168.1.10"
 rack = 0
 slot = 1
 
-def plc_connect():
+def plc_connect(plc_ip=plc_ip, rack=rack, slot=slot, timeout=None):
     try:
         # Create a Snap7 client instance
         plc = snap7.client.Client()
+        if timeout:
+            # Connect, send and receive timeouts (ms), so an offline PLC fails fast
+            plc.set_param(snap7.types.PingTimeout, timeout)
+            plc.set_param(snap7.types.SendTimeout, timeout)
+            plc.set_param(snap7.types.RecvTimeout, timeout)
         # Attempt to connect to the PLC using the configured parameters
-        plc.connect(plc_ip, rack, slot)
+        # (plc_ip may carry a port, e.g. "127.0.0.1:1102" for the PLC simulator)
+        address, _, port = plc_ip.partition(":")
+        plc.connect(address, rack, slot, int(port) if port else 102)
         print(f"Connected to PLC at {plc_ip}")
         return plc  # Return the connected PLC instance
     except: #snap7.exceptions.Snap7Exception as e:
         # Handle exceptions if there's an issue with the PLC connection
-        print(f"Error connecting to PLC")
+        print(f"Error connecting to PLC at {plc_ip}")
         return None
 
 def plc_disconnect(plc):
     try:
         # Disconnect from the PLC
         plc.disconnect()
-        print(f"Disconnected to PLC at {plc_ip}")
+        print(f"Disconnected from PLC")
     except: #snap7.exceptions.Snap7Exception as e:
         # Handle exceptions if there's an issue with the PLC connection
         print(f"Error disconnecting from PLC")
 
-from snap7 import types
-
 
 def read_multiple_variables(plc, items):
     """
-    Read multiple variables in a single request.
+    Read multiple DB ranges in a single request.
 
     Args:
     - plc: Snap7 client instance.
-    - items: List of items to read. Each item is a tuple (area, start, size, datatype).
-      Example: [(23, 0, 3, snap7.type.S7WLInt), (4, 0, 66, snap7.type.S7WLInt)]
+    - items: List of items to read. Each item is a tuple (db_number, start, size).
+      Example: [(8, 0, 20), (9, 4, 2)]
 
     Returns:
-    - List of values corresponding to the read items.
+    - List of memoryviews over the receive buffers, one per item, in the same order as items.
     """
-    # Create a list of ctype objects for each item
-    ctype_items = [type.S7DataItem() for _ in items]
+    # Create a ctype array with one S7DataItem (and one receive buffer) for each item
+    data_items = (snap7.types.S7DataItem * len(items))()
+    buffers = []
 
     # Populate the ctype objects with item information
-    for i, (area, start, size) in enumerate(items):
-        ctype_items[i].Area = area  # No need to encode to bytes
-        #ctype_items[i].WordLen = datatype
-        ctype_items[i].Result = 0  # Initialize the Result field
-        ctype_items[i].DBNumber = start
-        ctype_items[i].Start = start
-        ctype_items[i].Amount = size
-
-    # Convert the list of ctype objects to a ctype array
-    ctype_array = (type.S7DataItem * len(ctype_items))(*ctype_items)
+    for i, (db_number, start, size) in enumerate(items):
+        buffer = ctypes.create_string_buffer(size)
+        buffers.append(buffer)
+
+        data_items[i].Area = snap7.types.Areas.DB.value
+        data_items[i].WordLen = snap7.types.WordLen.Byte.value
+        data_items[i].Result = 0  # Initialize the Result field
+        data_items[i].DBNumber = db_number
+        data_items[i].Start = start
+        data_items[i].Amount = size
+        data_items[i].pData = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_uint8))
 
     # Perform the read operation
-    result = plc.read_multi_vars(ctype_array)
+    plc.read_multi_vars(data_items)
 
-    # Check if the result is an integer (indicating an error code)
-    if isinstance(result, int):
-        raise ValueError(f"Read operation failed with error code: {result}")
+    # Every item carries its own result code
+    for i, data_item in enumerate(data_items):
+        if data_item.Result != 0:
+            raise ValueError(f"Read operation failed for item {items[i]} with error code: {data_item.Result}")
 
     # Extract values from the result
-    values = [item.Data for item in result]
-
-    return values
+    return [memoryview(buffer).cast("B") for buffer in buffers]
 
 
 def read_bool(plc, db_number, byte_offset, bit_offset):
@@ -0,0 +1,108 @@
+import ctypes
+import logging
+import struct
+
+import snap7
+
+from service.PLC.processImage import get_process_image
+from service.PLC.readPlanner import DATA_TYPES, get_data_type, variable_size
+from service.PLC.snap7 import read_multiple_variables
+
+# snap7 refuses more items than this in a single write_multi_vars
+MAX_ITEMS_PER_REQUEST = 20
+
+
+class WriteBatch:
+    """
+    Collects the writes of one command and sends them to the PLC in a single
+    write_multi_vars request.
+
+    Bits can't be written alone, so the byte that holds them is taken from the
+    process image (the bytes read on the last poll) and only the requested bits
+    are changed. Bytes that aren't in the image, or that were read more than
+    max_image_age seconds ago (the PLC may have changed other bits of the byte
+    since), are read first, all of them in one request.
+    """
+
+    def __init__(self, plc, max_image_age=None):
+        self.plc = plc
+        self.max_image_age = max_image_age
+        self.items = {}
+        self.bits = {}
+
+    def write_bool(self, db_number, byte_offset, bit_offset, value):
+        set_mask, clear_mask = self.bits.get((db_number, byte_offset), (0, 0))
+        if value:
+            set_mask, clear_mask = set_mask | (1 << bit_offset), clear_mask & ~(1 << bit_offset)
+        else:
+            set_mask, clear_mask = set_mask & ~(1 << bit_offset), clear_mask | (1 << bit_offset)
+        self.bits[(db_number, byte_offset)] = (set_mask, clear_mask)
+
+    def write_variable(self, equipment_var, value):
+        data_type = get_data_type(equipment_var)
+        if data_type == "BOOL":
+            self.write_bool(int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']), value)
+            return
+
+        try:
+            data = struct.pack(">" + DATA_TYPES[data_type], value)
+        except (struct.error, OverflowError) as err:
+            if data_type == "REAL":
+                logging.error("%s. %s can't be written to %s", err, value, equipment_var['name'])
+                return
+            #out of range for the PLC type: keep the low bytes, like snap7.write_int always did
+            logging.warning("%s doesn't fit in %s (%s). Only its low bytes are written", value, equipment_var['name'], data_type)
+            size = variable_size(equipment_var)
+            data = (int(value) & ((1 << 8 * size) - 1)).to_bytes(size, "big")
+        self.items[(int(equipment_var['db_address']), int(equipment_var['offset_byte']))] = data
+
+    def _resolve_bits(self, image):
+        current = {key: image.get_byte(*key, max_age=self.max_image_age) for key in self.bits}
+
+        missing = [key for key, value in current.items() if value is None]
+        if missing:
+            buffers = read_multiple_variables(self.plc, [(db_number, byte_offset, 1) for db_number, byte_offset in missing])
+            for key, buffer in zip(missing, buffers):
+                current[key] = buffer[0]
+
+        for key, (set_mask, clear_mask) in self.bits.items():
+            self.items[key] = bytes([(current[key] | set_mask) & ~clear_mask & 0xFF])
+
+    def commit(self):
+        if not self.items and not self.bits:
+            return
+
+        image = get_process_image(self.plc)
+        self._resolve_bits(image)
+
+        items = sorted(self.items.items())
+        for chunk_start in range(0, len(items), MAX_ITEMS_PER_REQUEST):
+            chunk = items[chunk_start:chunk_start + MAX_ITEMS_PER_REQUEST]
+
+            if len(chunk) == 1:
+                (db_number, byte_offset), data = chunk[0]
+                self.plc.write_area(snap7.types.Areas.DB, db_number, byte_offset, bytearray(data))
+            else:
+                data_items = []
+                buffers = []
+                for (db_number, byte_offset), data in chunk:
+                    buffer = ctypes.create_string_buffer(data, len(data))
+                    buffers.append(buffer)
+
+                    data_item = snap7.types.S7DataItem()
+                    data_item.Area = snap7.types.Areas.DB.value
+                    data_item.WordLen = snap7.types.WordLen.Byte.value
+                    data_item.Result = 0
+                    data_item.DBNumber = db_number
+                    data_item.Start = byte_offset
+                    data_item.Amount = len(data)
+                    data_item.pData = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_uint8))
+                    data_items.append(data_item)
+
+                self.plc.write_multi_vars(data_items)
+
+            for (db_number, byte_offset), data in chunk:
+                image.update(db_number, byte_offset, data)
+
+        self.items = {}
+        self.bits = {}
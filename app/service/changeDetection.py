@@ -0,0 +1,49 @@
+import threading
+import time
+
+from variables import TELEMETRY_WRITE_MODE, TELEMETRY_DEADBAND, TELEMETRY_HEARTBEAT
+
+WRITE_ALWAYS = "always"
+WRITE_ON_CHANGE = "onChange"
+
+
+class ChangeDetector:
+    """
+    Decides if a value read from the PLC has to be stored, based on the last
+    value stored for the same key (an output, an equipment...).
+
+    In "always" mode every value is stored, like before. In "onChange" mode a
+    value is stored when it moved more than the deadband away from the last
+    stored value, or when heartbeat seconds passed since the last write, so
+    idle machines still leave a row from time to time.
+    """
+
+    def __init__(self, mode=WRITE_ALWAYS, deadband=0, heartbeat=0, clock=time.monotonic):
+        self.mode = mode
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last_values = {}
+
+    def changed(self, last_value, value):
+        if isinstance(value, (int, float)) and isinstance(last_value, (int, float)):
+            return abs(value - last_value) > self.deadband
+        return value != last_value
+
+    def shouldWrite(self, key, value):
+        if self.mode != WRITE_ON_CHANGE:
+            return True
+
+        now = self.clock()
+        with self.lock:
+            last = self.last_values.get(key)
+            if (last is None
+                    or self.changed(last[0], value)
+                    or (self.heartbeat and now - last[1] >= self.heartbeat)):
+                self.last_values[key] = (value, now)
+                return True
+            return False
+
+
+telemetry_change_detector = ChangeDetector(TELEMETRY_WRITE_MODE, float(TELEMETRY_DEADBAND), float(TELEMETRY_HEARTBEAT))
@@ -1,3 +1,6 @@
+from service.PLC.readPlanner import read_plan_cache
+from service.configurationCache import configuration_cache
+
 class ConfigurationService:
     def __init__(self, configuration_dao):
         self.configuration_dao = configuration_dao
@@ -18,16 +21,20 @@ class ConfigurationService:
         else: 
             #if exists, we update it
             updated_counting_equipment_id = configuration_dao.updateCountingEquipment(data)
-            currentOutputs = configuration_dao.getEquipmentOutputByEquipmentId(equipment_found['id'])
+            currentOutputs = configuration_dao.getEquipmentOutputByEquipmentId(equipment_found['id']) or []
+
+            #enabled outputs that are still in the message are kept as they are, the others are disabled,
+            #and the codes that aren't enabled yet are inserted as new outputs
+            current_codes = {output['code'] for output in currentOutputs}
+            new_codes = list(dict.fromkeys(data['outputCodes']))
+            removed_codes = current_codes.difference(new_codes)
+            added_codes = [code for code in new_codes if code not in current_codes]
+
+            configuration_dao.updateEquipmentOutputs(updated_counting_equipment_id, removed_codes, added_codes)
 
-            for output in currentOutputs:
-                configuration_dao.updateEquipmentOutputDisable(updated_counting_equipment_id, output['code'], 1)
-                
-                for newOutput in data['outputCodes']:
-                    if output['code'] == newOutput:
-                        configuration_dao.updateEquipmentOutputDisable(updated_counting_equipment_id, newOutput, 0)
-                        data['outputCodes'].remove(newOutput)
+            #the equipment changed, so its compiled PLC read plan has to be rebuilt on the next poll
+            read_plan_cache.invalidate(equipment_found['id'])
 
-            configuration_dao.insertEquipmentOutput(updated_counting_equipment_id, data)
+        configuration_cache.invalidate()
         
         print("createConfiguration function done")
\ No newline at end of file
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from types import MappingProxyType
+
+from database.connectionPool import db_pool
+from database.dao.configuration import ConfigurationDAO
+from variables import CONFIGURATION_CACHE_TTL
+
+
+def freeze(row):
+    return MappingProxyType(dict(row))
+
+
+class ConfigurationSnapshot:
+    """
+    Read-only copy of counting_equipment and equipment_output, shared by every
+    thread. Rows are read-only mappings and lists are tuples, so nobody can
+    change a snapshot another thread is using.
+
+    equipment_status is the one stored when the snapshot was loaded, the
+    current status has to be read from the database.
+    """
+
+    def __init__(self, equipments, outputs):
+        self.equipments = tuple(freeze(equipment) for equipment in equipments)
+        self.equipment_by_id = MappingProxyType({equipment['id']: equipment for equipment in self.equipments})
+        self.equipment_by_code = MappingProxyType({equipment['code']: equipment for equipment in self.equipments})
+
+        outputs_by_equipment = {}
+        for output in sorted(outputs, key=lambda output: output['id']):
+            outputs_by_equipment.setdefault(output['equipment_id'], []).append(freeze(output))
+        self.outputs_by_equipment = MappingProxyType({equipment_id: tuple(equipment_outputs) for equipment_id, equipment_outputs in outputs_by_equipment.items()})
+
+    def getEquipmentOutputs(self, equipment_id, include_disabled=False):
+        #ordered by id, like ConfigurationDAO.getEquipmentOutputById
+        outputs = self.outputs_by_equipment.get(equipment_id, ())
+        if include_disabled:
+            return outputs
+        return tuple(output for output in outputs if output['disable'] == 0)
+
+
+def read_configuration(connection):
+    configuration_dao = ConfigurationDAO(connection)
+    equipments = configuration_dao.getCountingEquipmentAll()
+    outputs = configuration_dao.getEquipmentOutput()
+    if equipments is None or outputs is None:
+        return None
+    return ConfigurationSnapshot(equipments, outputs)
+
+
+#with the caller's connection when it has one, so a thread never holds two pooled connections
+def load_configuration(connection=None):
+    if connection is not None:
+        return read_configuration(connection)
+    with db_pool.connection() as conn:
+        return read_configuration(conn)
+
+
+class ConfigurationCache:
+    """
+    Read-through cache of the equipment configuration.
+
+    get() returns the current snapshot, loading it when there is none or when
+    it is older than ttl seconds (0 = only reload after invalidate()). The
+    configuration only changes with a Configuration message, and
+    ConfigurationService calls invalidate() after applying it. If a reload
+    fails the previous snapshot is kept and the next get() tries again.
+
+    Callers that hold a pooled connection pass it to get(), and the reload
+    runs on it instead of taking a second one. Only one thread reloads at a
+    time and the lock isn't held meanwhile: the others keep getting the
+    previous snapshot until the new one is ready.
+    """
+
+    def __init__(self, loader=load_configuration, ttl=0, clock=time.monotonic):
+        self.loader = loader
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.loaded_at = 0
+        self.stale = True
+        self.loading = False
+        self.generation = 0
+
+    def get(self, connection=None):
+        with self.lock:
+            expired = self.ttl and self.clock() - self.loaded_at >= self.ttl
+            if self.snapshot is not None and (not (self.stale or expired) or self.loading):
+                return self.snapshot
+            self.loading = True
+            generation = self.generation
+
+        snapshot = None
+        try:
+            snapshot = self.loader(connection)
+        finally:
+            with self.lock:
+                self.loading = False
+                if snapshot is not None:
+                    #an invalidate() during the load means this snapshot may already be old
+                    self.snapshot, self.loaded_at, self.stale = snapshot, self.clock(), self.generation != generation
+                elif self.snapshot is None:
+                    logging.error("Configuration could not be loaded")
+                else:
+                    logging.warning("Configuration could not be reloaded. Using the previous one")
+                current = self.snapshot
+        return current if current is not None else ConfigurationSnapshot([], [])
+
+    def invalidate(self):
+        with self.lock:
+            self.stale = True
+            self.generation += 1
+
+
+configuration_cache = ConfigurationCache(ttl=float(CONFIGURATION_CACHE_TTL))
@@ -4,90 +4,65 @@ import sys
 import time
 import snap7
 
-from database.dao.activeTime import ActiveTimeDAO
-from database.dao.alarm import AlarmDAO
 from database.dao.equipmentVariables import EquipmentVariablesDAO
-from database.dao.counterRecord import CounterRecordDAO
 from database.dao.configuration import ConfigurationDAO
-from service.PLC.snap7 import plc_connect, plc_disconnect, read_bool, read_uint 
-import database.connectDB
-from database.config import load_config
+from database.dao.productionOrder import ProductionOrderDAO
+from service.PLC.connectionPool import plc_pool
+from service.PLC.readPlanner import get_pdu_size, read_plan_cache
+from service.changeDetection import telemetry_change_detector
+from service.configurationCache import configuration_cache
+from service.telemetryWriter import telemetry_writer
 import logging
+from variables import PLC_OFFLINE_STATUS
 
-def getPLCvalues(equipment):
+def getPLCvalues(equipment, conn):
     try:
-        config = load_config()
-        conn = database.connectDB.connect(config)
-
-        active_time_dao = ActiveTimeDAO(conn)
-        alarms_dao = AlarmDAO(conn)
         configuration_dao = ConfigurationDAO(conn)
-        counter_record_dao = CounterRecordDAO(conn)
         equipment_variables_dao = EquipmentVariablesDAO(conn)
 
         if equipment['plc_ip'] is not None and equipment['plc_ip'] != '0':
-            equipment_variables = equipment_variables_dao.getEquipmentVariablesByEquipmentId(equipment['id'])
-            array_of_equipment_variables_values = []
-
-            plc = plc_connect()
+            with plc_pool.connection(equipment['plc_ip']) as plc:
+                if plc is None:
+                    #PLC unreachable (or its circuit breaker is open): only flag the equipment as offline
+                    configuration_dao.updateCountingEquipmentStatus(equipment['id'], int(PLC_OFFLINE_STATUS))
+                    return int(PLC_OFFLINE_STATUS)
 
-            if plc is not None:
                 try:
-                    for equipment_var in equipment_variables:
-                        try:
-                            if equipment_var['name'] != "isEquipmentEnabled":
-                                equipment_var_value = read_uint(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']))
-                                array_of_equipment_variables_values.append(
-                                    {
-                                        "name": equipment_var['name'],
-                                        "value": equipment_var_value
-                                    }
-                                )
-                            else:
-                                equipment_var_value = read_bool(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']))
-                                array_of_equipment_variables_values.append(
-                                    {
-                                        "name": equipment_var['name'],
-                                        "value": equipment_var_value
-                                    }
-                                )
-                        except Exception as e:
-                            logging.error(f"Error reading PLC variable {equipment_var['name']}: {e}")
-                            raise Exception("Error while getting values from PLC")
-                finally:
-                    plc_disconnect(plc)
+                    #the plan is only compiled (and equipment_variable queried) when it isn't cached yet
+                    read_plan = read_plan_cache.get(
+                        equipment['id'],
+                        lambda: equipment_variables_dao.getEquipmentVariablesByEquipmentId(equipment['id']),
+                        get_pdu_size(plc))
+                    plc_values = read_plan.execute(plc)
+                except Exception as e:
+                    logging.error(f"Error reading PLC variables for equipment {equipment['id']}: {e}")
+                    raise Exception("Error while getting values from PLC")
 
-            alarms = {item['name']: item['value'] for item in array_of_equipment_variables_values if 'alarm' in item['name']}
-            outputs = [item for item in array_of_equipment_variables_values if 'output' in item['name']]
-            non_alarms = [item for item in array_of_equipment_variables_values if 'alarm' not in item['name']]
-            non_alarms_and_non_outputs = [item for item in non_alarms if 'output' not in item['name']]
+            alarms = plc_values['alarms']
+            outputs = plc_values['outputs']
 
-            equipment_db_outputs = configuration_dao.getEquipmentOutputById(equipment['id'])
+            equipment_db_outputs = configuration_cache.get(conn).getEquipmentOutputs(equipment['id'], include_disabled=True)
 
-            for index, output in enumerate(equipment_db_outputs):
-                if index < len(outputs):
-                    counter_record_dao.insertCounterRecord(output["id"], outputs[index]['value'])
+            #the production order open now is the one these readings count for, even if it is
+            #started or finished before the telemetry writer flushes them
+            production_order = ProductionOrderDAO(conn).getProductionOrderByCEquipmentIdIfNotFinished(equipment['id'])
+            production_order_id = production_order['id'] if production_order else 0
 
-            alarms_from_this_equipment = alarms_dao.getAlarmsByEquipmentId(equipment['id'])
-            if alarms_from_this_equipment is None:
-                alarms_dao.insertAlarm(equipment['id'], alarms)
-            else:
-                alarms_dao.updateAlarmByEquipmentId(equipment['id'], alarms)
+            #telemetry rows are buffered and committed in batches together with the other equipment
+            for index, output in enumerate(equipment_db_outputs):
+                if index < len(outputs) and telemetry_change_detector.shouldWrite(("counter_record", output["id"]), outputs[index]):
+                    telemetry_writer.addCounterRecord(output["id"], outputs[index], plc_values['outputWraps'][index], production_order_id)
 
-            active_time_value = 0
-            for item in non_alarms_and_non_outputs:
-                if item['name'] == 'activeTime':
-                    active_time_value = item['value']
-                    break
+            if telemetry_change_detector.shouldWrite(("alarm", equipment['id']), tuple(sorted(alarms.items()))):
+                telemetry_writer.setAlarms(equipment['id'], alarms)
 
-            if active_time_value:
-                active_time_dao.insertActiveTime(equipment['id'], active_time_value)
+            active_time_value = plc_values['activeTime']
+            if active_time_value and telemetry_change_detector.shouldWrite(("active_time", equipment['id']), active_time_value):
+                telemetry_writer.addActiveTime(equipment['id'], active_time_value, plc_values['activeTimeWrap'], production_order_id)
 
-            for item in non_alarms_and_non_outputs:
-                if item['name'] == 'equipmentStatus':
-                    equipment_status_value = item['value']
-                    configuration_dao.updateCountingEquipmentStatus(equipment['id'], equipment_status_value)
-                    break
+            if plc_values['equipmentStatus'] is not None:
+                configuration_dao.updateCountingEquipmentStatus(equipment['id'], plc_values['equipmentStatus'])
+                return plc_values['equipmentStatus']
 
     except Exception as e:
         logging.error(f"Error in getPLCvalues for equipment {equipment['id']}: {e}")
\ No newline at end of file
@@ -1,15 +1,38 @@
-import json
+from api.codec import topic_codecs
+from service.outbox import outbox
+
 
 #I will need to change this functions in order to know all the equipment_variables that each equipment have
 #then It will be necessary send the message with all the parameters.
 #But 1st we have to decide the better way to send it on our protocol
 
+#groups ProductionCount messages in ProductionCountBatch envelopes of at most max_bytes once encoded.
+#A message that doesn't fit in an empty envelope is still sent, alone in its own
+def batch_production_counts(messages, max_bytes, codec):
+    #room for the array header of the binary codecs, that grows with the number of items
+    envelope_size = len(codec.encode({"jsonType": "ProductionCountBatch", "productionCounts": []})) + 4
+    batches = []
+    batch, size = [], envelope_size
+    for message in messages:
+        message_size = len(codec.encode(message)) + 1
+        if batch and size + message_size > max_bytes:
+            batches.append(batch)
+            batch, size = [], envelope_size
+        batch.append(message)
+        size += message_size
+    if batch:
+        batches.append(batch)
+    return [codec.encode({"jsonType": "ProductionCountBatch", "productionCounts": batch}) for batch in batches]
+
+#the messages are built from the database: callers wait for telemetry_writer.wait_for_flush() first,
+#before taking the connection of the DAOs (the writer needs a connection from the same pool)
 class MessageService:
-    def __init__(self, configuration_dao, active_time_dao, counter_record_dao, alarm_dao):
+    def __init__(self, configuration_dao, active_time_dao, counter_record_dao, alarm_dao, production_count_dao=None):
         self.configuration_dao = configuration_dao
         self.active_time_dao = active_time_dao
         self.counter_record_dao = counter_record_dao
         self.alarm_dao = alarm_dao
+        self.production_count_dao = production_count_dao
 
     def sendResponseMessage(self, client, topicSend, data, jsonType): 
         configuration_dao = self.configuration_dao
@@ -19,22 +42,15 @@ class MessageService:
 
         equipment_found = configuration_dao.getCountingEquipmentByCode(data)  
         if equipment_found:
-            outputs = configuration_dao.getEquipmentOutputByEquipmentId(equipment_found['id'])
-            
             active_time_value = active_time_dao.getLastActiveTimeByEquipmentId(equipment_found['id'])
 
             time = 0
             if(active_time_value != None):
                 time = active_time_value['active_time']
             
-            counters = []
-            for output in outputs:
-                outputTotal = counter_record_dao.getLastCounterRecordByEquipmentOutputId(output['id'])
-                if(outputTotal == None):
-                    outputTotal = 0
-                else:
-                    outputTotal = outputTotal["real_value"]
-                counters.append({"outputCode": output['code'], "value": outputTotal})
+            #last values come from the latest value tables, one query for all the outputs
+            counters = [{"outputCode": counter['code'], "value": counter['real_value']}
+                        for counter in counter_record_dao.getLastCounterRecordsByEquipmentId(equipment_found['id']) or []]
 
             if "productionOrderCode" in data:
                 productionOrderCode = data["productionOrderCode"]
@@ -57,58 +73,36 @@ class MessageService:
             message.update({"alarms":alarm})
             message.update({"counters": counters})
 
-            client.publish(topicSend, json.dumps(message), qos=1)
+            outbox.publish(client, topicSend, topic_codecs.encode(topicSend, message), qos=1)
             print("Response message sent")
 
-
-
-    def sendProductionCount(self, client, topicSend, data): 
-        configuration_dao = self.configuration_dao
-        active_time_dao = self.active_time_dao
-        counter_record_dao = self.counter_record_dao 
-        alarm_dao = self.alarm_dao
-
-        outputs = configuration_dao.getEquipmentOutputByEquipmentId(data['equipment_id'])
-        #totalActiveTimeEquipment = active_time_dao.getActiveTimeTotalValueByEquipmentId(data['equipment_id'])
-        active_time_value = active_time_dao.getLastActiveTimeByEquipmentId(data['equipment_id'])
-
-        time = 0
-        if(active_time_value != None):
-            #time = totalActiveTimeEquipment["totalactivevalue"]
-            time = active_time_value['active_time']
-
-        counters = []
-        for output in outputs:
-            outputTotal = counter_record_dao.getLastCounterRecordByEquipmentOutputId(output['id'])
-            if(outputTotal == None):
-                outputTotal = 0
-            else:
-                outputTotal = outputTotal["real_value"]
-            counters.append({"outputCode": output['code'], "value": outputTotal})
-
-
-        alarms = alarm_dao.getAlarmsByEquipmentId(data['equipment_id'])
-        if alarms != None:
-            alarm = [alarms['alarm_0'], alarms['alarm_1'], alarms['alarm_2'], alarms['alarm_3']]
+    #one ProductionCount per equipment, all built from a single snapshot query.
+    #equipment_status has the status each equipment got from its poll (None to use the one stored).
+    #With batch_max_bytes the messages go in ProductionCountBatch envelopes of at most that size instead
+    def sendProductionCounts(self, client, topicSend, equipment_status, batch_max_bytes=None):
+        snapshot = self.production_count_dao.getProductionCountSnapshot(list(equipment_status)) or []
+        messages = []
+        for equipment in snapshot:
+            status = equipment_status.get(equipment['equipment_id'])
+
+            message = {
+            "jsonType": "ProductionCount",
+            "equipmentCode": equipment['equipment_code'],
+            "productionOrderCode": equipment['production_order_code'],
+            "equipmentStatus": status if status is not None else equipment['equipment_status'],
+            "activeTime": equipment['active_time'],
+            "alarms": equipment['alarms'],
+            "counters": equipment['counters']
+            }
+
+            messages.append(message)
+
+        if batch_max_bytes:
+            batches = batch_production_counts(messages, batch_max_bytes, topic_codecs.forTopic(topicSend))
+            for batch in batches:
+                outbox.publish(client, topicSend, batch, qos=1)
+            print(f"ProductionCount sent for {len(snapshot)} equipment in {len(batches)} ProductionCountBatch")
         else:
-            alarm = [0, 0, 0, 0]
-
-        message = {
-        "jsonType": "ProductionCount",
-        "equipmentCode": data['equipment_code'], 
-        "productionOrderCode": data['code'],
-        "equipmentStatus": data['equipment_status'],
-        "activeTime":time,
-        "alarms": alarm,
-        "counters": counters
-        }
-        message.update({"jsonType": "ProductionCount"})
-        message.update({"equipmentCode": data['equipment_code']})
-        message.update({"productionOrderCode": data['code']})
-        message.update({"equipmentStatus": data['equipment_status']})
-        message.update({"activeTime":time})
-        message.update({"alarms":alarm})
-        message.update({"counters": counters})
-  
-        client.publish(topicSend, json.dumps(message), qos=1)
-        print("ProductionCount sent")
\ No newline at end of file
+            for message in messages:
+                outbox.publish(client, topicSend, topic_codecs.encode(topicSend, message), qos=1)
+            print(f"ProductionCount sent for {len(snapshot)} equipment")
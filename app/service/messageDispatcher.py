@@ -0,0 +1,120 @@
+import logging
+import queue
+import threading
+import time
+import zlib
+
+
+class MessageDispatcher:
+    """
+    Runs the handler of the received MES messages on a pool of worker threads,
+    so the MQTT network thread only decodes and queues them.
+
+    Messages are sharded by key (the equipmentCode): every message of an
+    equipment goes to the same worker and they are handled in the order they
+    arrived, while different equipment are handled in parallel. Each worker has
+    a queue of at most queue_size messages; when it is full submit() blocks
+    until there is room, which slows down the broker instead of growing the
+    memory.
+
+    metrics() has the queue depth of every worker and the time the messages
+    waited and took to handle, which are logged every report_interval seconds.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=100, report_interval=60, clock=time.monotonic):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.queues = []
+        self.threads = []
+        self.running = False
+        self.stats = {"handled": 0, "failures": 0, "blocked": 0, "wait_time": 0.0, "handle_time": 0.0, "max_handle_time": 0.0}
+        self.last_report = (clock(), dict(self.stats))
+
+    def shard(self, key):
+        #crc32 instead of hash() so an equipment always goes to the same worker
+        return zlib.crc32(str(key or "").encode()) % self.workers
+
+    def submit(self, key, *args):
+        if not self.running:
+            self._handle(self.clock(), args)
+            return
+
+        shard_queue = self.queues[self.shard(key)]
+        item = (self.clock(), args)
+        try:
+            shard_queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.stats["blocked"] += 1
+            logging.warning("Message queue of %s is full. Waiting for the worker", key)
+            shard_queue.put(item)
+
+    def _handle(self, queued_at, args):
+        started = self.clock()
+        try:
+            self.handler(*args)
+            failed = False
+        except Exception as err:
+            logging.error("%s. Message handling failed", err)
+            failed = True
+
+        handle_time = self.clock() - started
+        with self.lock:
+            self.stats["handled"] += 1
+            self.stats["failures"] += failed
+            self.stats["wait_time"] += started - queued_at
+            self.stats["handle_time"] += handle_time
+            self.stats["max_handle_time"] = max(self.stats["max_handle_time"], handle_time)
+
+    def _run(self, shard_queue):
+        while True:
+            item = shard_queue.get()
+            if item is None:
+                return
+            self._handle(*item)
+            if self.report_interval and self.clock() - self.last_report[0] >= self.report_interval:
+                self.report()
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return self
+            self.queues = [queue.Queue(self.queue_size) for _ in range(self.workers)]
+            self.threads = [threading.Thread(target=self._run, args=(shard_queue,), name=f"messageWorker-{index}", daemon=True)
+                            for index, shard_queue in enumerate(self.queues)]
+            for thread in self.threads:
+                thread.start()
+            self.running = True
+        return self
+
+    def stop(self):
+        #the workers handle what is already queued before exiting
+        with self.lock:
+            self.running = False
+        for shard_queue in self.queues:
+            shard_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.queues, self.threads = [], []
+
+    def metrics(self):
+        with self.lock:
+            return dict(self.stats, queue_depths=[shard_queue.qsize() for shard_queue in self.queues])
+
+    def report(self):
+        now = self.clock()
+        with self.lock:
+            since, stats_before = self.last_report
+            stats = dict(self.stats)
+            self.last_report = (now, stats)
+        handled = stats["handled"] - stats_before["handled"]
+        wait_time = (stats["wait_time"] - stats_before["wait_time"]) / handled if handled else 0
+        handle_time = (stats["handle_time"] - stats_before["handle_time"]) / handled if handled else 0
+        depths = [shard_queue.qsize() for shard_queue in self.queues]
+        logging.info("MES messages: %d handled, %.3fs average wait, %.3fs average handling, queue depths %s",
+                     handled, wait_time, handle_time, depths)
+        return handled, wait_time, handle_time, depths
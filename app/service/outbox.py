@@ -0,0 +1,204 @@
+import logging
+import sqlite3
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from variables import OUTBOX_PATH, OUTBOX_MAX_BYTES, OUTBOX_REPLAY_RATE, OUTBOX_MMAP_SIZE, OUTBOX_ACK_TIMEOUT, OUTBOX_MAX_INFLIGHT
+
+
+class Outbox:
+    """
+    Store-and-forward for the MQTT messages published while the broker is not
+    reachable.
+
+    While connected (and with nothing stored) publish() hands the message to
+    paho as before. While disconnected the message is appended to a SQLite
+    outbox on disk instead of paho's in-memory queue, so it survives a restart
+    and doesn't use RAM. Once a message is stored the next ones are stored too,
+    until the outbox is empty again, so the MES receives them in order.
+
+    After reconnecting a thread replays the stored messages oldest first, at
+    most replay_rate per second. Up to max_inflight of them wait for their ack
+    at the same time, so the replay isn't limited to one message per round
+    trip to the broker; each one is deleted once the broker acked it, and a
+    message whose ack doesn't arrive in ack_timeout seconds is sent again. The
+    outbox keeps at most max_bytes of payloads; when it is full the
+    oldest messages are dropped, down to 90% of max_bytes.
+    """
+
+    def __init__(self, path="outbox.db", max_bytes=268435456, replay_rate=50, mmap_size=67108864, ack_timeout=10, max_inflight=20, clock=time.monotonic):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.replay_rate = replay_rate
+        self.mmap_size = mmap_size
+        self.ack_timeout = ack_timeout
+        self.max_inflight = max(1, max_inflight)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.connection = None
+        self.client = None
+        self.connected = False
+        self.running = False
+        self.thread = None
+        self.stored_rows = 0
+        self.stored_bytes = 0
+        self.stats = {"stored": 0, "replayed": 0, "dropped": 0}
+
+    def open(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        connection.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            qos INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """)
+        self.stored_rows, self.stored_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(length(payload)), 0) FROM outbox").fetchone()
+        if self.stored_rows:
+            logging.info("Outbox has %d messages from a previous run", self.stored_rows)
+        return connection
+
+    def publish(self, client, topic, payload, qos=0):
+        with self.condition:
+            if not self.running or (self.connected and not self.stored_rows):
+                info = client.publish(topic, payload, qos=qos)
+                if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                    #the connection dropped before on_disconnect was called. paho keeps this one, the next ones are stored
+                    self.connected = False
+                return info
+
+            self._store(topic, payload, qos)
+            return None
+
+    def _store(self, topic, payload, qos):
+        #called with the lock held
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.connection.execute("INSERT INTO outbox (topic, payload, qos, created_at) VALUES (?, ?, ?, ?)",
+                                (topic, payload, qos, time.time()))
+        self.stored_rows += 1
+        self.stored_bytes += len(payload)
+        self.stats["stored"] += 1
+
+        if self.stored_bytes > self.max_bytes:
+            self._trim()
+
+    def _trim(self):
+        #called with the lock held. Drops the oldest messages down to 90% of max_bytes, so a full outbox
+        #isn't trimmed again on every publish. Only the rows dropped are walked, then one DELETE
+        excess = self.stored_bytes - int(self.max_bytes * 0.9)
+        dropped, freed, last_id = 0, 0, None
+        for message_id, size in self.connection.execute("SELECT id, length(payload) FROM outbox ORDER BY id"):
+            dropped, freed, last_id = dropped + 1, freed + size, message_id
+            if freed >= excess:
+                break
+        if last_id is None:
+            return
+        self.connection.execute("DELETE FROM outbox WHERE id <= ?", (last_id,))
+        self.stored_rows -= dropped
+        self.stored_bytes -= freed
+        self.stats["dropped"] += dropped
+        logging.error("Outbox is full. %d messages were dropped", dropped)
+
+    def setConnected(self, connected):
+        with self.condition:
+            self.connected = connected
+            self.condition.notify_all()
+
+    def _next(self, last_sent, inflight):
+        #waits until there is something to replay. Returns the oldest message after last_sent, None when
+        #the window is full or every stored message was sent, False when stopping
+        with self.condition:
+            self.condition.wait_for(lambda: not self.running or (self.connected and self.stored_rows))
+            if not self.running:
+                return False
+            if inflight >= self.max_inflight:
+                return None
+            return self.connection.execute("SELECT id, topic, payload, qos FROM outbox WHERE id > ? ORDER BY id LIMIT 1", (last_sent,)).fetchone()
+
+    def _delete(self, message_id, size):
+        with self.condition:
+            if self.connection.execute("DELETE FROM outbox WHERE id = ?", (message_id,)).rowcount:
+                self.stored_rows -= 1
+                self.stored_bytes -= size
+                self.stats["replayed"] += 1
+
+    def _acknowledge(self, inflight):
+        #deletes the messages the broker acked and sends again the ones that weren't acked in ack_timeout
+        now = self.clock()
+        for message_id, (info, message, sent_at) in list(inflight.items()):
+            if info.is_published():
+                del inflight[message_id]
+                self._delete(message_id, len(message[1]))
+            elif now - sent_at >= self.ack_timeout:
+                logging.warning("Outbox message %d wasn't acked in %s seconds. Sending it again", message_id, self.ack_timeout)
+                info = self.client.publish(*message[:2], qos=message[2])
+                if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                    inflight[message_id] = (info, message, now)
+
+    def _run(self):
+        #messages sent and waiting for their ack, by id. Only this thread uses it
+        inflight, last_sent = {}, 0
+        interval = 1 / self.replay_rate if self.replay_rate > 0 else 0
+        while True:
+            message = self._next(last_sent, len(inflight))
+            if message is False:
+                return
+            self._acknowledge(inflight)
+
+            if message is not None:
+                message_id, topic, payload, qos = message
+                info = self.client.publish(topic, payload, qos=qos)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    #not sent: try it again after waiting one replay interval
+                    logging.warning("Outbox replay of message %d failed. Retrying", message_id)
+                else:
+                    last_sent = message_id
+                    if qos == 0:
+                        self._delete(message_id, len(payload))
+                    else:
+                        inflight[message_id] = (info, (topic, payload, qos), self.clock())
+
+            #with nothing sent (window full, or only acks to wait for) poll the acks at least every 10ms
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, interval if message is not None else max(interval, 0.01))
+
+    def start(self, client):
+        with self.condition:
+            if self.running:
+                return self
+            self.connection = self.open()
+            self.client = client
+            self.connected = client.is_connected()
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        #the messages still stored are replayed on the next start
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        with self.condition:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def metrics(self):
+        with self.condition:
+            return dict(self.stats, rows=self.stored_rows, bytes=self.stored_bytes, connected=self.connected)
+
+
+outbox = Outbox(OUTBOX_PATH, int(OUTBOX_MAX_BYTES), float(OUTBOX_REPLAY_RATE), int(OUTBOX_MMAP_SIZE), float(OUTBOX_ACK_TIMEOUT), int(OUTBOX_MAX_INFLIGHT))
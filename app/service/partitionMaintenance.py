@@ -0,0 +1,99 @@
+import datetime
+import logging
+import threading
+
+from database.connectionPool import db_pool
+from database.dao.partition import PartitionDAO
+from variables import TELEMETRY_RETENTION_DAYS, TELEMETRY_PARTITIONS_AHEAD, TELEMETRY_MAINTENANCE_INTERVAL
+
+#tables partitioned by month on registered_at (migration 0006)
+PARTITIONED_TABLES = ["counter_record", "active_time"]
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+class PartitionMaintenance:
+    """
+    Keeps the monthly partitions of the telemetry tables ready and applies the
+    retention.
+
+    Every run creates the partitions up to months_ahead months from now and
+    drops the partitions whose whole range is older than retention_days, with
+    the rows they hold. The running totals (migration 0007) are kept apart, so
+    they still include the dropped data. A retention of 0 keeps everything.
+    """
+
+    def __init__(self, retention_days=0, months_ahead=2, interval=3600, database_pool=db_pool, clock=datetime.datetime.now):
+        self.retention_days = retention_days
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self.database_pool = database_pool
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def createPartitions(self, partition_dao, table, partitions):
+        ends = [partition['end'] for partition in partitions if partition['end'] is not None]
+        if not ends:
+            return
+        #rows are stamped with the current time, so months already gone never need a partition
+        this_month = month_start(self.clock())
+        partition_start = max(max(ends), this_month)
+        until = add_months(this_month, self.months_ahead + 1)
+        while partition_start < until:
+            partition_end = add_months(partition_start, 1)
+            name = f"{table}_y{partition_start:%Y}m{partition_start:%m}"
+            if not partition_dao.createPartition(table, name, partition_start, partition_end):
+                return
+            partition_start = partition_end
+
+    def dropExpiredPartitions(self, partition_dao, table, partitions):
+        if not self.retention_days:
+            return
+        cutoff = self.clock() - datetime.timedelta(days=self.retention_days)
+        for partition in partitions:
+            if not partition['default'] and partition['end'] is not None and partition['end'] <= cutoff:
+                partition_dao.dropPartition(table, partition['name'])
+
+    def run(self):
+        with self.database_pool.connection() as conn:
+            partition_dao = PartitionDAO(conn)
+            for table in PARTITIONED_TABLES:
+                partitions = partition_dao.getPartitions(table)
+                if not partitions:
+                    logging.warning("Table %s is not partitioned. Skipping its maintenance", table)
+                    continue
+
+                self.createPartitions(partition_dao, table, partitions)
+                self.dropExpiredPartitions(partition_dao, table, partitions)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.run()
+            except Exception as err:
+                logging.error("%s. Partition maintenance failed", err)
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="partitionMaintenance", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+partition_maintenance = PartitionMaintenance(int(TELEMETRY_RETENTION_DAYS), int(TELEMETRY_PARTITIONS_AHEAD), float(TELEMETRY_MAINTENANCE_INTERVAL))
@@ -1,62 +1,84 @@
-import json
+import logging
 import os
+import queue
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from database.dao.counterRecord import CounterRecordDAO
 from service.getPLCvalues import getPLCvalues
 from service.message import MessageService
-from database.dao.activeTime import ActiveTimeDAO 
+from database.dao.activeTime import ActiveTimeDAO
 from database.dao.configuration import ConfigurationDAO
 from database.dao.alarm import AlarmDAO
 from database.dao.productionCount import ProductionCountDAO
-from database.dao.productionOrder import ProductionOrderDAO
+from service.scheduler import DeadlineScheduler
+from service.configurationCache import configuration_cache
+from service.telemetryWriter import telemetry_writer
+from database.connectionPool import db_pool
+from variables import POLLING_MAX_WORKERS, SCHEDULER_MAX_SLEEP, PRODUCTION_COUNT_BATCH, PRODUCTION_COUNT_BATCH_MAX_BYTES, PRODUCTION_COUNT_BATCH_LINGER, TELEMETRY_FLUSH_WAIT_TIMEOUT
 
-import database.connectDB
-from database.config import load_config
+def pollEquipment(equipment, completed_polls):
+    #only reads the PLC and stores its values, the ProductionCount is published by publishProductionCounts
+    equipment_status = None
+    try:
+        with db_pool.connection() as conn:
+            equipment_status = getPLCvalues(equipment, conn)
 
-def productionCount(client, topicSend):
-    config = load_config()
-    conn = database.connectDB.connect(config)
-    start = time.time()            
-    
+    except Exception as err:
+        logging.error("%s. pollEquipment failed for equipment %s", err, equipment['id'])
+    finally:
+        completed_polls.put((equipment['id'], equipment_status))
+
+def publishProductionCounts(client, topicSend, completed_polls, batch=False, batch_max_bytes=131072, batch_linger=0):
+    while True:
+        #every poll that finished meanwhile is published from the same query.
+        #When batching, wait up to batch_linger for the rest of the equipment due in the same tick
+        polls = [completed_polls.get()]
+        linger_until = time.monotonic() + batch_linger if batch else 0
+        while True:
+            remaining = linger_until - time.monotonic()
+            try:
+                polls.append(completed_polls.get(timeout=remaining) if remaining > 0 else completed_polls.get_nowait())
+            except queue.Empty:
+                break
+
+        #the values of these polls may still be in the telemetry buffer. Wait before taking a connection,
+        #the writer needs one to flush them
+        if not telemetry_writer.wait_for_flush(float(TELEMETRY_FLUSH_WAIT_TIMEOUT)):
+            logging.warning("Telemetry wasn't flushed in %s seconds. ProductionCount may have old values", TELEMETRY_FLUSH_WAIT_TIMEOUT)
+
+        try:
+            with db_pool.connection() as conn:
+                message_service = MessageService(ConfigurationDAO(conn), ActiveTimeDAO(conn), CounterRecordDAO(conn), AlarmDAO(conn), ProductionCountDAO(conn))
+                message_service.sendProductionCounts(client, topicSend, dict(polls), batch_max_bytes if batch else None)
 
-    configuration_dao = ConfigurationDAO(conn)
-    active_time_dao = ActiveTimeDAO(conn)
-    production_order_dao = ProductionOrderDAO(conn)
-    counter_record_dao = CounterRecordDAO(conn)
-    alarm_dao = AlarmDAO(conn)
+        except Exception as err:
+            logging.error("%s. publishProductionCounts failed", err)
+
+def productionCount(client, topicSend):
+    #PLCs are polled in parallel, but each equipment has at most one poll in flight so its cycles stay in order
+    executor = ThreadPoolExecutor(max_workers=int(POLLING_MAX_WORKERS), thread_name_prefix="poll")
+    polls_in_flight = {}
+    completed_polls = queue.Queue()
+    threading.Thread(target=publishProductionCounts, name="productionCountPublisher", daemon=True,
+                     args=(client, topicSend, completed_polls, bool(int(PRODUCTION_COUNT_BATCH)), int(PRODUCTION_COUNT_BATCH_MAX_BYTES), float(PRODUCTION_COUNT_BATCH_LINGER))).start()
+    scheduler = DeadlineScheduler()
 
     while True:
-        end = time.time()
-        length = end - start
-        equipments = configuration_dao.getCountingEquipmentAll()
- 
-        for equipment in equipments:
-            if(round(round(length) % equipment['p_timer_communication_cycle']) == 0 and round(length) != 0):
-                getPLCvalues(equipment)
-                existPO = production_order_dao.getProductionOrderByCEquipmentIdIfNotFinished(equipment['id'])
-                print(existPO)
-                if not existPO:
-                    temp_list = json.dumps({}, indent = 4)
-                    temp_list = json.loads(temp_list)
-                    temp_list.update({"code": ""})
-                    temp_list.update({"equipment_code": equipment['code']})
-                    temp_list.update({"equipment_id": equipment['id']})
-                    temp_list.update({"equipment_status": equipment['equipment_status']})
-                    
-                    message_service = MessageService(configuration_dao, active_time_dao, counter_record_dao, alarm_dao)
-                    message_service.sendProductionCount(client, topicSend, temp_list)
-                else:
-                    #active_time_dao.insertActiveTime(equipment['id'], equipment['p_timer_communication_cycle'])
-                    temp_list = json.dumps(existPO, indent = 4)
-                    temp_list = json.loads(temp_list)
-                    temp_list.update({"p_timer_communication_cycle": equipment['p_timer_communication_cycle']})
-                    temp_list.update({"equipment_code": equipment['code']})
-                    temp_list.update({"equipment_id": equipment['id']})
-                    temp_list.update({"equipment_status": equipment['equipment_status']})
-                    
-                    message_service = MessageService(configuration_dao, active_time_dao, counter_record_dao, alarm_dao)
-                    message_service.sendProductionCount(client, topicSend, temp_list)
-                    
-        time.sleep(1)
\ No newline at end of file
+        #only hits the database after a Configuration message (or when the cache TTL expires)
+        equipments = configuration_cache.get().equipment_by_id
+        scheduler.sync({equipment['id']: equipment['p_timer_communication_cycle'] for equipment in equipments.values()
+                        if equipment['p_timer_communication_cycle'] and equipment['p_timer_communication_cycle'] > 0})
+
+        #sleep until the next equipment is due, waking up at least every SCHEDULER_MAX_SLEEP to pick up configuration changes
+        for equipment_id in scheduler.wait(max_wait=float(SCHEDULER_MAX_SLEEP)):
+            equipment = equipments[equipment_id]
+
+            previous_poll = polls_in_flight.get(equipment_id)
+            if previous_poll is not None and not previous_poll.done():
+                logging.warning("Previous poll of equipment %s is still running. Skipping this cycle.", equipment_id)
+                continue
+
+            polls_in_flight[equipment_id] = executor.submit(pollEquipment, equipment, completed_polls)
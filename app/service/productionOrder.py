@@ -1,6 +1,7 @@
 import snap7
 from service.getPLCvalues import getPLCvalues
-from service.PLC.snap7 import plc_connect, plc_disconnect, write_bool, write_int
+from service.PLC.connectionPool import plc_pool
+from service.PLC.writeBatch import WriteBatch
 
 class ProductionOrderService:
     def __init__(self, configuration_dao, production_order_dao, active_time_dao, equipment_variables_dao):
@@ -9,6 +10,33 @@ class ProductionOrderService:
         self.active_time_dao = active_time_dao
         self.equipment_variables_dao = equipment_variables_dao
 
+    def writeCommand(self, plc, equipment_variables, data, max_image_age=None):
+        #all the command values are sent to the PLC in one request.
+        #bit writes use the bytes of the last poll only if they are younger than one poll cycle
+        write_batch = WriteBatch(plc, max_image_age)
+
+        for equipment_var in equipment_variables:
+            if equipment_var['name'] == "isEquipmentEnabled":
+                if data['equipmentEnabled'] is True:
+                    isEquipmentEnabled = 1
+                else:
+                    isEquipmentEnabled = 0
+                write_batch.write_variable(equipment_var, isEquipmentEnabled)
+
+            if equipment_var['name'] == "targetAmount":
+                write_batch.write_variable(equipment_var, data['targetAmount'])
+
+        write_batch.commit()
+
+    def sendCommand(self, equipment_data, equipment_variables, data):
+        #equipment without a PLC has nothing to write to (and must not count as a failure of a PLC)
+        if equipment_data['plc_ip'] is None or equipment_data['plc_ip'] == '0':
+            return
+
+        with plc_pool.connection(equipment_data['plc_ip']) as plc:
+            if plc is not None:
+                self.writeCommand(plc, equipment_variables, data, equipment_data['p_timer_communication_cycle'] or 0)
+
     def productionOrderInit(self, data):
         configuration_dao = self.configuration_dao
         production_order_dao = self.production_order_dao
@@ -17,7 +45,7 @@ class ProductionOrderService:
         if data['productionOrderCode'] != "":
             #check if exists some counting_equipment with this code and get this id
             equipment_data = configuration_dao.getCountingEquipmentByCode(data)
-            getPLCvalues(equipment_data)
+            getPLCvalues(equipment_data, configuration_dao.connection)
             
             #if equipment_data['equipment_status'] == 1:
                 #update production order code
@@ -31,23 +59,9 @@ class ProductionOrderService:
 
             #Here, instead of setEquipmentStatus i need to write on the PLC offset for isEquipmentEnable the value 1
             equipment_variables = equipment_variables_dao.getEquipmentVariablesByEquipmentId(equipment_data['id'])
-            plc = plc_connect()
-
-            if plc is not None:    
-                for equipment_var in equipment_variables:
-                    if equipment_var['name'] == "isEquipmentEnabled":
-                        if data['equipmentEnabled'] is True:
-                            isEquipmentEnabled = 1
-                        else:
-                            isEquipmentEnabled = 0
-                        write_bool(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']), isEquipmentEnabled)
-                    
-                    if equipment_var['name'] == "targetAmount":
-                        write_int(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), data['targetAmount'])
-
-            plc_disconnect(plc)
+            self.sendCommand(equipment_data, equipment_variables, data)
 
-        getPLCvalues(equipment_data)
+        getPLCvalues(equipment_data, configuration_dao.connection)
 
         print("ProductionInit function done")
 
@@ -60,7 +74,7 @@ class ProductionOrderService:
         #check if exists some counting_equipment with this code and get this id
         equipment_data = configuration_dao.getCountingEquipmentByCode(data)
         #get values from PLC
-        getPLCvalues(equipment_data)
+        getPLCvalues(equipment_data, configuration_dao.connection)
         #setting po as finished
         production_order_dao.setPOFinished(equipment_data['id'])
 
@@ -68,24 +82,9 @@ class ProductionOrderService:
         #Here, instead of setEquipmentStatus i need to write on the PLC offset for isEquipmentEnable the value 0
         equipment_variables = equipment_variables_dao.getEquipmentVariablesByEquipmentId(equipment_data['id'])
         
-        plc = plc_connect()
-
-        if plc is not None:    
-            for equipment_var in equipment_variables:
-                if equipment_var['name'] == "isEquipmentEnabled":
-                    
-                    if data['equipmentEnabled'] is True:
-                        isEquipmentEnabled = 1
-                    else:
-                        isEquipmentEnabled = 0
-                    write_bool(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']), isEquipmentEnabled)
-                
-                if equipment_var['name'] == "targetAmount":
-                    write_int(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), data['targetAmount'])
-
-        plc_disconnect(plc)
-
-        getPLCvalues(equipment_data)
+        self.sendCommand(equipment_data, equipment_variables, data)
+
+        getPLCvalues(equipment_data, configuration_dao.connection)
         print("ProductionConclusion function done")
 
 
@@ -105,22 +104,8 @@ class ProductionOrderService:
 
             #Here, instead of setEquipmentStatus i need to write on the PLC offset for isEquipmentEnable the value 1
             equipment_variables = equipment_variables_dao.getEquipmentVariablesByEquipmentId(equipment_data['id'])
-            plc = plc_connect()
-
-            if plc is not None:    
-                for equipment_var in equipment_variables:
-                    if equipment_var['name'] == "isEquipmentEnabled":
-                        if data['equipmentEnabled'] is True:
-                            isEquipmentEnabled = 1
-                        else:
-                            isEquipmentEnabled = 0
-                        write_bool(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']), isEquipmentEnabled)
-                    
-                    if equipment_var['name'] == "targetAmount":
-                        write_int(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), data['targetAmount'])
-
-            plc_disconnect(plc)
-
-            getPLCvalues(equipment_data)  
+            self.sendCommand(equipment_data, equipment_variables, data)
+
+            getPLCvalues(equipment_data, configuration_dao.connection)  
             print("ProductionInit function done")
         
\ No newline at end of file
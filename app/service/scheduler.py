@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import logging
+import time
+
+
+class DeadlineScheduler:
+    """
+    Keeps a next-due deadline for every equipment on a monotonic clock.
+
+    Deadlines advance by whole intervals from the previous deadline (not from
+    the moment the task ran), so the cycle doesn't drift when a poll is slow.
+    When the loop falls behind by one or more intervals the missed deadlines
+    are reported and the task is scheduled at the next future deadline instead
+    of firing several times in a row.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.queue = []
+        self.sequence = itertools.count()
+        self.intervals = {}
+        self.deadlines = {}
+        self.missed_deadlines = {}
+
+    def schedule(self, key, interval):
+        if self.intervals.get(key) == interval:
+            return
+        self.intervals[key] = interval
+        self._push(key, self.clock() + interval)
+
+    def unschedule(self, key):
+        #entries left in the queue are discarded when they reach the top
+        self.intervals.pop(key, None)
+        self.deadlines.pop(key, None)
+
+    def sync(self, intervals):
+        """Make the scheduled keys match intervals ({key: interval in seconds})."""
+        for key in list(self.intervals):
+            if key not in intervals:
+                self.unschedule(key)
+        for key, interval in intervals.items():
+            self.schedule(key, interval)
+
+    def _push(self, key, deadline):
+        self.deadlines[key] = deadline
+        heapq.heappush(self.queue, (deadline, next(self.sequence), key))
+
+    def _discard_stale(self):
+        while self.queue and self.deadlines.get(self.queue[0][2]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+
+    def time_until_next(self):
+        self._discard_stale()
+        if not self.queue:
+            return None
+        return max(0.0, self.queue[0][0] - self.clock())
+
+    def pop_due(self):
+        now = self.clock()
+        due = []
+
+        self._discard_stale()
+        while self.queue and self.queue[0][0] <= now:
+            deadline, _, key = heapq.heappop(self.queue)
+            interval = self.intervals[key]
+            due.append(key)
+
+            missed = int((now - deadline) // interval)
+            if missed > 0:
+                self.missed_deadlines[key] = self.missed_deadlines.get(key, 0) + missed
+                logging.warning("Equipment %s missed %d deadline(s) (%.3fs late).", key, missed, now - deadline)
+
+            self._push(key, deadline + (missed + 1) * interval)
+            self._discard_stale()
+
+        return due
+
+    def wait(self, max_wait=None):
+        """Sleep until the next task is due (at most max_wait seconds) and return the due keys."""
+        timeout = self.time_until_next()
+        if max_wait is not None and (timeout is None or timeout > max_wait):
+            timeout = max_wait
+        if timeout:
+            self.sleep(timeout)
+        return self.pop_due()
@@ -0,0 +1,251 @@
+import datetime
+import logging
+import threading
+import time
+
+from database.connectionPool import db_pool
+from database.dao.telemetry import TelemetryDAO, BATCH_REJECTED
+from variables import TELEMETRY_FLUSH_ROWS, TELEMETRY_FLUSH_INTERVAL, TELEMETRY_MAX_BUFFERED_ROWS, TELEMETRY_INGEST_MODE, TELEMETRY_REPORT_INTERVAL
+
+INGEST_INSERT = "insert"
+INGEST_COPY = "copy"
+
+
+#(counter records, active times, alarms) -> two batches with half of the rows each
+def split_batch(batch):
+    rows = [(table, row) for table, table_rows in enumerate(batch) for row in table_rows]
+    half = len(rows) // 2
+    return [tuple([row for table, row in part if table == index] for index in range(len(batch))) for part in (rows[:half], rows[half:])]
+
+
+class TelemetryWriter:
+    """
+    Buffers the counter records, active times and alarms read from the PLCs and
+    writes them to the database in batches, one transaction per flush.
+
+    A flush happens when flush_rows rows are waiting or flush_interval seconds
+    passed since the last one, so the number of commits depends on the poll
+    cycles and not on the number of equipment or outputs. Callers that read the
+    values back from the database (the MES messages) call wait_for_flush()
+    first, which returns once the rows they added are committed.
+
+    If a flush fails the rows are kept for the next one, up to
+    max_buffered_rows; after that the oldest rows are dropped. A batch the
+    database rejects (a value that doesn't fit its column, a key that was
+    deleted) is split until the bad rows are found, and only those are dropped.
+
+    In "copy" ingest mode the rows are streamed with COPY FROM STDIN instead of
+    multi-row INSERTs, for high polling rates. Every report_interval seconds
+    the writer logs the rows/s written and the backlog.
+    """
+
+    def __init__(self, flush_rows=500, flush_interval=1, max_buffered_rows=50000, ingest_mode=INGEST_INSERT, report_interval=60, database_pool=db_pool, clock=time.monotonic):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        self.ingest_mode = ingest_mode
+        self.report_interval = report_interval
+        self.database_pool = database_pool
+        self.clock = clock
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.counter_records = []
+        self.active_times = []
+        self.alarms = {}
+        #where the PLC counter of each key wraps around, kept across flushes
+        self.wraps = {"counter_record": {}, "active_time": {}}
+        self.generation = 0
+        self.flushed_generation = 0
+        self.flush_requested = False
+        self.last_flush = clock()
+        self.thread = None
+        self.running = False
+        self.stats = {"flushes": 0, "rows": 0, "failures": 0, "dropped": 0, "rejected": 0, "flush_time": 0.0}
+        self.last_report = (clock(), 0)
+
+    def pending_rows(self):
+        return len(self.counter_records) + len(self.active_times) + len(self.alarms)
+
+    def _added(self):
+        #called with the condition held
+        if self.pending_rows() >= self.flush_rows:
+            self.condition.notify_all()
+
+    #production_order_id is the production order open when the value was read (0 for none): the running
+    #totals are credited to it even if the order is started or finished before the row is flushed
+    def addCounterRecord(self, equipment_output_id, value, wrap=None, production_order_id=0):
+        with self.condition:
+            self.counter_records.append((equipment_output_id, value, datetime.datetime.now(), production_order_id))
+            if wrap is not None:
+                self.wraps["counter_record"][equipment_output_id] = wrap
+            self._added()
+
+    def addActiveTime(self, equipment_id, value, wrap=None, production_order_id=0):
+        with self.condition:
+            self.active_times.append((equipment_id, value, datetime.datetime.now(), production_order_id))
+            if wrap is not None:
+                self.wraps["active_time"][equipment_id] = wrap
+            self._added()
+
+    def setAlarms(self, equipment_id, alarms):
+        #the alarm table keeps one row per equipment, so only the last alarms of a batch are written
+        with self.condition:
+            self.alarms[equipment_id] = (equipment_id, alarms.get("alarm_0"), alarms.get("alarm_1"), alarms.get("alarm_2"), alarms.get("alarm_3"), datetime.datetime.now())
+            self._added()
+
+    def _take(self):
+        with self.condition:
+            batch = (self.counter_records, self.active_times, list(self.alarms.values()))
+            self.counter_records, self.active_times, self.alarms = [], [], {}
+            self.generation += 1
+            self.flush_requested = False
+            self.last_flush = self.clock()
+            wraps = {table: dict(table_wraps) for table, table_wraps in self.wraps.items()}
+            return batch, self.generation, wraps
+
+    def _give_back(self, batch):
+        counter_records, active_times, alarms = batch
+        with self.condition:
+            self.counter_records = counter_records + self.counter_records
+            self.active_times = active_times + self.active_times
+            for alarm in alarms:
+                self.alarms.setdefault(alarm[0], alarm)
+
+            overflow = self.pending_rows() - self.max_buffered_rows
+            if overflow > 0:
+                dropped_counters = min(overflow, len(self.counter_records))
+                del self.counter_records[:dropped_counters]
+                del self.active_times[:overflow - dropped_counters]
+                self.stats["dropped"] += overflow
+                logging.error("Telemetry buffer is full. %d rows were dropped", overflow)
+
+    def flush(self):
+        with self.flush_lock:
+            batch, generation, wraps = self._take()
+            rows = sum(len(rows) for rows in batch)
+
+            unstored, rejected = None, 0
+            if rows:
+                started = self.clock()
+                try:
+                    with self.database_pool.connection() as conn:
+                        unstored, rejected = self._store(TelemetryDAO(conn), batch, wraps)
+                except Exception as err:
+                    logging.error("%s. Telemetry flush failed", err)
+                    unstored = batch
+            stored = unstored is None
+
+            with self.condition:
+                if rows:
+                    self.stats["flushes"] += 1
+                    self.stats["flush_time"] += self.clock() - started
+                    self.stats["rows"] += rows - rejected - (sum(len(table_rows) for table_rows in unstored) if unstored else 0)
+                    self.stats["rejected"] += rejected
+                    if not stored:
+                        self.stats["failures"] += 1
+                #waiters are released even when the flush failed, the rows will go with the next one
+                self.flushed_generation = generation
+                self.condition.notify_all()
+
+            if not stored:
+                self._give_back(unstored)
+            return stored
+
+    def _store(self, telemetry_dao, batch, wraps):
+        #returns the rows to retry (None when there are none) and how many rows were rejected
+        result = telemetry_dao.insertTelemetryBatch(*batch, use_copy=self.ingest_mode == INGEST_COPY, wraps=wraps)
+        if result is True:
+            return None, 0
+        if result != BATCH_REJECTED:
+            return batch, 0
+        if sum(len(table_rows) for table_rows in batch) == 1:
+            logging.error("Telemetry row %s was rejected by the database. It was dropped", next(row for table_rows in batch for row in table_rows))
+            return None, 1
+
+        #the halves are stored in order, so the running totals still see the rows of a key oldest first
+        first, second = split_batch(batch)
+        unstored, rejected = self._store(telemetry_dao, first, wraps)
+        if unstored is not None:
+            return tuple(unstored_rows + second_rows for unstored_rows, second_rows in zip(unstored, second)), rejected
+        unstored, second_rejected = self._store(telemetry_dao, second, wraps)
+        return unstored, rejected + second_rejected
+
+    def wait_for_flush(self, timeout=None):
+        """
+        Blocks until every row added before the call is flushed, asking the
+        background thread to flush now instead of at the end of the interval.
+        Returns right away when nothing is buffered or being flushed. Without
+        the background thread the rows are flushed right away.
+        """
+        if not self.running:
+            self.flush()
+            return True
+
+        with self.condition:
+            if self.pending_rows():
+                target = self.generation + 1
+                self.flush_requested = True
+                self.condition.notify_all()
+            else:
+                #only the flush already running (if any) has rows of this caller
+                target = self.generation
+            return self.condition.wait_for(lambda: self.flushed_generation >= target or not self.running, timeout)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.flush_requested and self.pending_rows() < self.flush_rows:
+                    remaining = self.last_flush + self.flush_interval - self.clock()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                running = self.running
+
+            stored = self.flush()
+            if self.report_interval and self.clock() - self.last_report[0] >= self.report_interval:
+                self.report()
+            if not running:
+                return
+
+            if not stored:
+                #the database is having problems: wait a whole interval before retrying, even if the buffer is full
+                retry_at = self.clock() + self.flush_interval
+                with self.condition:
+                    while self.running and self.clock() < retry_at:
+                        self.condition.wait(retry_at - self.clock())
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="telemetryWriter", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        #the thread flushes what is left before exiting
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def metrics(self):
+        with self.condition:
+            return dict(self.stats, pending=self.pending_rows(), mode=self.ingest_mode)
+
+    def report(self):
+        now = self.clock()
+        with self.condition:
+            since, rows_before = self.last_report
+            rows, backlog = self.stats["rows"], self.pending_rows()
+            self.last_report = (now, rows)
+        rows_per_second = (rows - rows_before) / (now - since) if now > since else 0
+        logging.info("Telemetry ingest (%s): %.1f rows/s, backlog %d rows", self.ingest_mode, rows_per_second, backlog)
+        return rows_per_second, backlog
+
+
+telemetry_writer = TelemetryWriter(int(TELEMETRY_FLUSH_ROWS), float(TELEMETRY_FLUSH_INTERVAL), int(TELEMETRY_MAX_BUFFERED_ROWS),
+                                  TELEMETRY_INGEST_MODE, float(TELEMETRY_REPORT_INTERVAL))
@@ -0,0 +1,16 @@
+ALTER TABLE equipment_variable
+ADD COLUMN data_type VARCHAR(10) NOT NULL DEFAULT 'UINT';
+
+UPDATE equipment_variable
+SET data_type = 'BOOL'
+WHERE name = 'isEquipmentEnabled';
+
+ALTER TABLE counter_record
+ALTER COLUMN real_value TYPE BIGINT;
+
+ALTER TABLE active_time
+ALTER COLUMN active_time TYPE BIGINT;
+
+INSERT INTO audit_script (run_date, process, version, schema)
+VALUES
+    (CURRENT_DATE, '0003_equipmentVariableDataType.sql', '1.0.0', '1.0.0_0003');
@@ -0,0 +1,29 @@
+CREATE TABLE counter_record_latest (
+    equipment_output_id INTEGER PRIMARY KEY,
+    real_value BIGINT,
+    registered_at TIMESTAMP,
+    FOREIGN KEY (equipment_output_id) REFERENCES equipment_output(id)
+);
+
+CREATE TABLE active_time_latest (
+    equipment_id INTEGER PRIMARY KEY,
+    active_time BIGINT,
+    registered_at TIMESTAMP,
+    FOREIGN KEY (equipment_id) REFERENCES counting_equipment(id)
+);
+
+INSERT INTO counter_record_latest (equipment_output_id, real_value, registered_at)
+SELECT DISTINCT ON (equipment_output_id) equipment_output_id, real_value, registered_at
+FROM counter_record
+WHERE equipment_output_id IS NOT NULL
+ORDER BY equipment_output_id, registered_at DESC, id DESC;
+
+INSERT INTO active_time_latest (equipment_id, active_time, registered_at)
+SELECT DISTINCT ON (equipment_id) equipment_id, active_time, registered_at
+FROM active_time
+WHERE equipment_id IS NOT NULL
+ORDER BY equipment_id, registered_at DESC, id DESC;
+
+INSERT INTO audit_script (run_date, process, version, schema)
+VALUES
+    (CURRENT_DATE, '0004_latestValues.sql', '1.0.0', '1.0.0_0004');
@@ -0,0 +1,29 @@
+CREATE INDEX IF NOT EXISTS counter_record_output_registered_at_idx
+ON counter_record (equipment_output_id, registered_at DESC);
+
+CREATE INDEX IF NOT EXISTS active_time_equipment_registered_at_idx
+ON active_time (equipment_id, registered_at DESC);
+
+CREATE INDEX IF NOT EXISTS alarm_equipment_id_idx
+ON alarm (equipment_id, id DESC);
+
+CREATE INDEX IF NOT EXISTS production_order_equipment_finished_idx
+ON production_order (equipment_id, finished, id DESC);
+
+CREATE INDEX IF NOT EXISTS equipment_output_equipment_idx
+ON equipment_output (equipment_id, disable);
+
+CREATE INDEX IF NOT EXISTS equipment_variable_equipment_idx
+ON equipment_variable (equipment_id);
+
+CREATE INDEX IF NOT EXISTS counting_equipment_code_idx
+ON counting_equipment (code);
+
+ANALYZE counter_record;
+ANALYZE active_time;
+ANALYZE alarm;
+ANALYZE production_order;
+
+INSERT INTO audit_script (run_date, process, version, schema)
+VALUES
+    (CURRENT_DATE, '0005_hotPathIndexes.sql', '1.0.0', '1.0.0_0005');
@@ -0,0 +1,69 @@
+-- counter_record and active_time become tables partitioned by month on registered_at.
+-- The existing tables are kept as one partition holding everything up to the current month.
+
+ALTER TABLE counter_record RENAME TO counter_record_legacy;
+ALTER TABLE counter_record_legacy RENAME CONSTRAINT counter_record_pkey TO counter_record_legacy_pkey;
+ALTER INDEX counter_record_output_registered_at_idx RENAME TO counter_record_legacy_output_registered_at_idx;
+UPDATE counter_record_legacy SET registered_at = '1970-01-01' WHERE registered_at IS NULL;
+ALTER TABLE counter_record_legacy ALTER COLUMN registered_at SET NOT NULL;
+
+CREATE TABLE counter_record (
+    id INTEGER NOT NULL DEFAULT nextval('counter_record_id_seq'),
+    equipment_output_id INTEGER REFERENCES equipment_output(id),
+    real_value BIGINT,
+    registered_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, registered_at)
+) PARTITION BY RANGE (registered_at);
+
+ALTER SEQUENCE counter_record_id_seq OWNED BY counter_record.id;
+
+CREATE INDEX counter_record_output_registered_at_idx
+ON counter_record (equipment_output_id, registered_at DESC);
+
+ALTER TABLE active_time RENAME TO active_time_legacy;
+ALTER TABLE active_time_legacy RENAME CONSTRAINT active_time_pkey TO active_time_legacy_pkey;
+ALTER INDEX active_time_equipment_registered_at_idx RENAME TO active_time_legacy_equipment_registered_at_idx;
+UPDATE active_time_legacy SET registered_at = '1970-01-01' WHERE registered_at IS NULL;
+ALTER TABLE active_time_legacy ALTER COLUMN registered_at SET NOT NULL;
+
+CREATE TABLE active_time (
+    id INTEGER NOT NULL DEFAULT nextval('active_time_id_seq'),
+    equipment_id INTEGER REFERENCES counting_equipment(id),
+    active_time BIGINT,
+    registered_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, registered_at)
+) PARTITION BY RANGE (registered_at);
+
+ALTER SEQUENCE active_time_id_seq OWNED BY active_time.id;
+
+CREATE INDEX active_time_equipment_registered_at_idx
+ON active_time (equipment_id, registered_at DESC);
+
+DO $$
+DECLARE
+    table_name TEXT;
+    legacy_end TIMESTAMP;
+    partition_start TIMESTAMP;
+BEGIN
+    FOREACH table_name IN ARRAY ARRAY['counter_record', 'active_time'] LOOP
+        EXECUTE format('SELECT GREATEST(date_trunc(''month'', LOCALTIMESTAMP), date_trunc(''month'', MAX(registered_at)) + INTERVAL ''1 month'') FROM %I', table_name || '_legacy')
+        INTO legacy_end;
+
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (MINVALUE) TO (%L)', table_name, table_name || '_legacy', legacy_end);
+
+        -- this month and the next one, the partition maintenance job creates the following ones
+        FOR month_offset IN 0..1 LOOP
+            partition_start := legacy_end + make_interval(months => month_offset);
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                table_name || '_y' || to_char(partition_start, 'YYYY') || 'm' || to_char(partition_start, 'MM'),
+                table_name, partition_start, partition_start + INTERVAL '1 month');
+        END LOOP;
+
+        -- keeps rows outside every partition instead of failing the insert
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', table_name || '_default', table_name);
+    END LOOP;
+END $$;
+
+INSERT INTO audit_script (run_date, process, version, schema)
+VALUES
+    (CURRENT_DATE, '0006_telemetryPartitioning.sql', '1.0.0', '1.0.0_0006');
@@ -0,0 +1,101 @@
+-- Running totals of the PLC counters, updated with every telemetry batch.
+-- production_order_id 0 holds the lifetime total, the other rows the total of one production order.
+
+CREATE TABLE counter_record_total (
+    equipment_output_id INTEGER NOT NULL,
+    production_order_id INTEGER NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    resets INTEGER NOT NULL DEFAULT 0,
+    wraps INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (equipment_output_id, production_order_id),
+    FOREIGN KEY (equipment_output_id) REFERENCES equipment_output(id)
+);
+
+CREATE INDEX counter_record_total_production_order_idx
+ON counter_record_total (production_order_id);
+
+CREATE TABLE active_time_total (
+    equipment_id INTEGER NOT NULL,
+    production_order_id INTEGER NOT NULL DEFAULT 0,
+    total BIGINT NOT NULL DEFAULT 0,
+    resets INTEGER NOT NULL DEFAULT 0,
+    wraps INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP,
+    PRIMARY KEY (equipment_id, production_order_id),
+    FOREIGN KEY (equipment_id) REFERENCES counting_equipment(id)
+);
+
+CREATE INDEX active_time_total_production_order_idx
+ON active_time_total (production_order_id);
+
+-- lifetime totals from the history. Counters wrap where their PLC type does (INT/UINT at 65536, DINT/UDINT at 2^32,
+-- REAL never), within the default TELEMETRY_COUNTER_WRAP_WINDOW of 4096. A drop from a value at or above the wrap
+-- point, or one that doesn't fit the window, is a reset and the counter starts again from 0.
+-- The outputs of an equipment are matched to its output variables by position at runtime; here the widest type wins.
+-- The history doesn't say which production order was open, so per order totals start now.
+INSERT INTO counter_record_total (equipment_output_id, production_order_id, total, resets, wraps, updated_at)
+SELECT equipment_output_id, 0,
+    COALESCE(SUM(CASE
+        WHEN previous IS NULL THEN 0
+        WHEN real_value >= previous THEN real_value - previous
+        WHEN wrapped THEN real_value + wrap - previous
+        ELSE GREATEST(real_value, 0) END), 0),
+    COUNT(*) FILTER (WHERE real_value < previous AND NOT wrapped),
+    COUNT(*) FILTER (WHERE wrapped),
+    MAX(registered_at)
+FROM (
+    SELECT equipment_output_id, real_value, registered_at, previous, wrap,
+        COALESCE(real_value < previous AND previous < wrap AND real_value + wrap - previous BETWEEN 1 AND 4096, FALSE) AS wrapped
+    FROM (
+        SELECT cr.equipment_output_id, cr.real_value, cr.registered_at, COALESCE(ow.wrap, 65536) AS wrap,
+            LAG(cr.real_value) OVER (PARTITION BY cr.equipment_output_id ORDER BY cr.registered_at, cr.id) AS previous
+        FROM counter_record cr
+        LEFT JOIN (
+            SELECT eo.id, MAX(CASE upper(ev.data_type)
+                WHEN 'INT' THEN 65536 WHEN 'UINT' THEN 65536
+                WHEN 'DINT' THEN 4294967296 WHEN 'UDINT' THEN 4294967296
+                ELSE 0 END) AS wrap
+            FROM equipment_output eo
+            JOIN equipment_variable ev ON ev.equipment_id = eo.equipment_id AND ev.name LIKE '%output%'
+            GROUP BY eo.id
+        ) ow ON ow.id = cr.equipment_output_id
+        WHERE cr.equipment_output_id IS NOT NULL AND cr.real_value IS NOT NULL
+    ) readings
+) history
+GROUP BY equipment_output_id;
+
+INSERT INTO active_time_total (equipment_id, production_order_id, total, resets, wraps, updated_at)
+SELECT equipment_id, 0,
+    COALESCE(SUM(CASE
+        WHEN previous IS NULL THEN 0
+        WHEN active_time >= previous THEN active_time - previous
+        WHEN wrapped THEN active_time + wrap - previous
+        ELSE GREATEST(active_time, 0) END), 0),
+    COUNT(*) FILTER (WHERE active_time < previous AND NOT wrapped),
+    COUNT(*) FILTER (WHERE wrapped),
+    MAX(registered_at)
+FROM (
+    SELECT equipment_id, active_time, registered_at, previous, wrap,
+        COALESCE(active_time < previous AND previous < wrap AND active_time + wrap - previous BETWEEN 1 AND 4096, FALSE) AS wrapped
+    FROM (
+        SELECT atr.equipment_id, atr.active_time, atr.registered_at, COALESCE(aw.wrap, 65536) AS wrap,
+            LAG(atr.active_time) OVER (PARTITION BY atr.equipment_id ORDER BY atr.registered_at, atr.id) AS previous
+        FROM active_time atr
+        LEFT JOIN (
+            SELECT equipment_id, MAX(CASE upper(data_type)
+                WHEN 'INT' THEN 65536 WHEN 'UINT' THEN 65536
+                WHEN 'DINT' THEN 4294967296 WHEN 'UDINT' THEN 4294967296
+                ELSE 0 END) AS wrap
+            FROM equipment_variable
+            WHERE name = 'activeTime'
+            GROUP BY equipment_id
+        ) aw ON aw.equipment_id = atr.equipment_id
+        WHERE atr.equipment_id IS NOT NULL AND atr.active_time IS NOT NULL
+    ) readings
+) history
+GROUP BY equipment_id;
+
+INSERT INTO audit_script (run_date, process, version, schema)
+VALUES
+    (CURRENT_DATE, '0007_runningTotals.sql', '1.0.0', '1.0.0_0007');
@@ -0,0 +1,97 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from service.PLC.connectionPool import PLCConnectionPool
+from service.PLC.readPlanner import ReadPlanCache, get_pdu_size
+from service.PLC.snap7 import plc_connect, read_bool, read_uint
+from utils.plcSimulator import DEFAULT_DB_NUMBER, DEFAULT_LAYOUT, LatencyPLC, SimulatedPLC
+
+#Measures PLC acquisition against simulated PLCs, without hardware or database.
+#Run it from the app folder: python -m utils.benchmarkAcquisition --machines 20 --latency 5
+
+
+def build_layout(extra_variables):
+    layout = list(DEFAULT_LAYOUT)
+    for index in range(extra_variables):
+        layout.append({"name": f"tag{index}", "db_address": str(DEFAULT_DB_NUMBER), "offset_byte": 22 + 2 * index, "offset_bit": 0, "data_type": "UINT"})
+    return layout
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def poll_per_variable(plc, layout):
+    #one request per variable, like getPLCvalues used to do
+    for equipment_var in layout:
+        if equipment_var['name'] == "isEquipmentEnabled":
+            read_bool(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']))
+        else:
+            read_uint(plc, int(equipment_var['db_address']), int(equipment_var['offset_byte']))
+
+
+def run(machines, cycles, latency, workers, base_port, extra_variables, per_variable):
+    layout = build_layout(extra_variables)
+    simulators = []
+    for index in range(machines):
+        simulator = SimulatedPLC(base_port + index, {DEFAULT_DB_NUMBER: 22 + 2 * extra_variables})
+        simulator.load_default_layout()
+        simulators.append(simulator.start())
+
+    def connect(plc_ip):
+        plc = plc_connect(plc_ip)
+        if plc is not None and latency:
+            return LatencyPLC(plc, latency)
+        return plc
+
+    pool = PLCConnectionPool(connect=connect)
+    plans = ReadPlanCache()
+    latencies = []
+
+    def poll(index, simulator):
+        started = time.perf_counter()
+        with pool.connection(simulator.address) as plc:
+            if per_variable:
+                poll_per_variable(plc, layout)
+            else:
+                plans.get(index, lambda: layout, get_pdu_size(plc)).execute(plc)
+        return time.perf_counter() - started
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            #first cycle connects every PLC and compiles the plans, it isn't measured
+            list(executor.map(poll, range(machines), simulators))
+
+            started = time.perf_counter()
+            for _ in range(cycles):
+                latencies.extend(executor.map(poll, range(machines), simulators))
+            elapsed = time.perf_counter() - started
+    finally:
+        pool.close_all()
+        for simulator in simulators:
+            simulator.stop()
+
+    polls = machines * cycles
+    print(f"mode: {'per-variable' if per_variable else 'read plan'}, machines: {machines}, variables: {len(layout)}, workers: {workers}, latency: {latency * 1000:.1f}ms")
+    print(f"polls: {polls} in {elapsed:.3f}s -> {polls / elapsed:.1f} polls/s, {polls * len(layout) / elapsed:.1f} variables/s")
+    print(f"poll latency: p50 {percentile(latencies, 50) * 1000:.2f}ms, p99 {percentile(latencies, 99) * 1000:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PLC acquisition against simulated PLCs.")
+    parser.add_argument("--machines", type=int, default=10, help="number of simulated PLCs")
+    parser.add_argument("--cycles", type=int, default=50, help="poll cycles to measure")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency injected in every PLC request (ms)")
+    parser.add_argument("--workers", type=int, default=8, help="polling threads")
+    parser.add_argument("--port", type=int, default=1102, help="TCP port of the first simulated PLC")
+    parser.add_argument("--variables", type=int, default=0, help="extra uint variables per PLC")
+    parser.add_argument("--per-variable", action="store_true", help="read every variable with its own request")
+    args = parser.parse_args()
+
+    run(args.machines, args.cycles, args.latency / 1000, args.workers, args.port, args.variables, args.per_variable)
+
+
+if __name__ == '__main__':
+    main()
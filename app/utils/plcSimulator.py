@@ -0,0 +1,160 @@
+import argparse
+import ctypes
+import struct
+import threading
+import time
+
+import snap7
+
+from service.PLC.readPlanner import DATA_TYPES, get_data_type
+
+#Same DB layout as the test PLC (see main_teste_PLC.py), as equipment_variable rows
+DEFAULT_DB_NUMBER = 8
+DEFAULT_LAYOUT = [
+    {"name": "isEquipmentEnabled", "db_address": "8", "offset_byte": 0, "offset_bit": 0, "data_type": "BOOL"},
+    {"name": "equipmentStatus", "db_address": "8", "offset_byte": 4, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "activeTime", "db_address": "8", "offset_byte": 6, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "alarm_0", "db_address": "8", "offset_byte": 8, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "alarm_1", "db_address": "8", "offset_byte": 10, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "alarm_2", "db_address": "8", "offset_byte": 12, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "alarm_3", "db_address": "8", "offset_byte": 14, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "output0", "db_address": "8", "offset_byte": 16, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "output1", "db_address": "8", "offset_byte": 18, "offset_bit": 0, "data_type": "UINT"},
+    {"name": "targetAmount", "db_address": "8", "offset_byte": 20, "offset_bit": 0, "data_type": "UINT"},
+]
+
+
+class SimulatedPLC:
+    """
+    S7 PLC simulated with the snap7 server. DB contents can be set from code
+    and counters can ramp up on their own, so the acquisition code can be run
+    (and measured) without real hardware.
+    """
+
+    def __init__(self, port=1102, db_sizes=None):
+        self.port = port
+        self.server = snap7.server.Server(log=False)
+        self.dbs = {}
+        self.ramps = []
+        self.running = False
+        self.thread = None
+
+        for db_number, size in (db_sizes or {DEFAULT_DB_NUMBER: 64}).items():
+            self.dbs[db_number] = (ctypes.c_uint8 * size)()
+            self.server.register_area(snap7.types.srvAreaDB, db_number, self.dbs[db_number])
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.port}"
+
+    def _write(self, db_number, write):
+        #lock the area so a client never reads a half written value
+        self.server.lock_area(snap7.types.srvAreaDB, db_number)
+        try:
+            write(self.dbs[db_number])
+        finally:
+            self.server.unlock_area(snap7.types.srvAreaDB, db_number)
+
+    def set_uint(self, db_number, offset_byte, value):
+        self._write(db_number, lambda db: struct.pack_into(">H", db, offset_byte, value & 0xFFFF))
+
+    def get_uint(self, db_number, offset_byte):
+        return struct.unpack_from(">H", self.dbs[db_number], offset_byte)[0]
+
+    def set_bool(self, db_number, offset_byte, offset_bit, value):
+        def write(db):
+            if value:
+                db[offset_byte] |= 1 << offset_bit
+            else:
+                db[offset_byte] &= ~(1 << offset_bit) & 0xFF
+        self._write(db_number, write)
+
+    def set_variable(self, equipment_var, value):
+        data_type = get_data_type(equipment_var)
+        if data_type == "BOOL":
+            self.set_bool(int(equipment_var['db_address']), int(equipment_var['offset_byte']), int(equipment_var['offset_bit']), value)
+        else:
+            self._write(int(equipment_var['db_address']), lambda db: struct.pack_into(">" + DATA_TYPES[data_type], db, int(equipment_var['offset_byte']), value))
+
+    def ramp(self, db_number, offset_byte, step=1, interval=1.0):
+        """Add step to the uint at offset_byte every interval seconds (wrapping at 65535)."""
+        self.ramps.append({"db_number": db_number, "offset_byte": offset_byte, "step": step, "interval": interval, "due": time.monotonic() + interval})
+
+    def load_default_layout(self):
+        for equipment_var in DEFAULT_LAYOUT:
+            self.set_variable(equipment_var, 0)
+        self.set_variable(DEFAULT_LAYOUT[0], 1)
+        self.set_variable(DEFAULT_LAYOUT[1], 1)
+        self.ramp(DEFAULT_DB_NUMBER, 6, step=1, interval=1.0)
+        self.ramp(DEFAULT_DB_NUMBER, 16, step=1, interval=0.5)
+        self.ramp(DEFAULT_DB_NUMBER, 18, step=1, interval=2.0)
+
+    def _run_ramps(self):
+        while self.running:
+            now = time.monotonic()
+            for ramp in self.ramps:
+                if now >= ramp['due']:
+                    self.set_uint(ramp['db_number'], ramp['offset_byte'], self.get_uint(ramp['db_number'], ramp['offset_byte']) + ramp['step'])
+                    ramp['due'] += ramp['interval']
+            time.sleep(0.05)
+
+    def start(self):
+        self.server.start(tcpport=self.port)
+        self.running = True
+        self.thread = threading.Thread(target=self._run_ramps, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.server.stop()
+        self.server.destroy()
+
+
+class LatencyPLC:
+    """Wraps a snap7 client and adds a fixed delay to every request, to simulate slow networks."""
+
+    DELAYED_CALLS = ("read_area", "write_area", "read_multi_vars", "write_multi_vars")
+
+    def __init__(self, plc, latency):
+        self.plc = plc
+        self.latency = latency
+
+    def __getattr__(self, name):
+        attribute = getattr(self.plc, name)
+        if name not in self.DELAYED_CALLS:
+            return attribute
+
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency)
+            return attribute(*args, **kwargs)
+        return delayed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run simulated S7 PLCs with the default DB layout.")
+    parser.add_argument("--port", type=int, default=1102, help="TCP port of the first PLC")
+    parser.add_argument("--machines", type=int, default=1, help="number of PLCs (on consecutive ports)")
+    args = parser.parse_args()
+
+    plcs = []
+    for index in range(args.machines):
+        plc = SimulatedPLC(args.port + index)
+        plc.load_default_layout()
+        plcs.append(plc.start())
+        print(f"Simulated PLC listening at {plc.address}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Ctrl+C pressed... Shutting down.")
+    finally:
+        for plc in plcs:
+            plc.stop()
+
+
+if __name__ == '__main__':
+    main()
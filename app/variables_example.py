@@ -12,4 +12,44 @@ MAX_RECONNECT_DELAY=60
 databaseIni="./database.ini"
 ca_cert="path/AmazonRootCA1.pem"
 certfile="path/cert.pem"
-keyfile="path/private.key"
\ No newline at end of file
+keyfile="path/private.key"
+POLLING_MAX_WORKERS=8
+SCHEDULER_MAX_SLEEP=1
+TELEMETRY_WRITE_MODE="onChange"
+TELEMETRY_DEADBAND=0
+TELEMETRY_HEARTBEAT=300
+PLC_TIMEOUT=1000
+PLC_BREAKER_FAILURES=3
+PLC_BREAKER_BACKOFF=5
+PLC_BREAKER_MAX_BACKOFF=300
+PLC_OFFLINE_STATUS=-1
+DB_POOL_MIN=2
+DB_POOL_MAX=12
+DB_POOL_HEALTH_CHECK_INTERVAL=30
+DB_POOL_REPORT_INTERVAL=60
+TELEMETRY_FLUSH_ROWS=500
+TELEMETRY_FLUSH_INTERVAL=1
+TELEMETRY_MAX_BUFFERED_ROWS=50000
+TELEMETRY_RETENTION_DAYS=0
+TELEMETRY_PARTITIONS_AHEAD=2
+TELEMETRY_MAINTENANCE_INTERVAL=3600
+TELEMETRY_INGEST_MODE="insert"
+TELEMETRY_REPORT_INTERVAL=60
+CONFIGURATION_CACHE_TTL=300
+DB_PREPARED_STATEMENTS=1
+TELEMETRY_COUNTER_WRAP_WINDOW=4096
+PRODUCTION_COUNT_BATCH=0
+PRODUCTION_COUNT_BATCH_MAX_BYTES=131072
+PRODUCTION_COUNT_BATCH_LINGER=0.2
+MQTT_CODEC="json"
+MQTT_TOPIC_CODECS=""
+MESSAGE_WORKERS=4
+MESSAGE_QUEUE_SIZE=100
+MESSAGE_REPORT_INTERVAL=60
+OUTBOX_PATH="outbox.db"
+OUTBOX_MAX_BYTES=268435456
+OUTBOX_REPLAY_RATE=50
+OUTBOX_MMAP_SIZE=67108864
+OUTBOX_ACK_TIMEOUT=10
+OUTBOX_MAX_INFLIGHT=20
+TELEMETRY_FLUSH_WAIT_TIMEOUT=5
\ No newline at end of file